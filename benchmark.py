@@ -0,0 +1,253 @@
+'''Offline benchmarks for the mods, run against the fake Content-DB in fakes.py
+
+    python benchmark.py --sizes 100 1000 10000 100000 --save
+    python benchmark.py --only status.query status.update --compare bench_results/<rev>.json
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from prettytable import PrettyTable
+
+import fakes
+import sheets
+from mods import Status, Scheduler
+from reminders import ReminderStore
+from utils import check_similar, TitleIndex
+
+
+def percentile(values, q):
+    '''Nearest-rank percentile of a list of numbers'''
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def measure(op, repeat):
+    '''Returns the latencies of `repeat` runs of the coroutine function op and the peak memory of one run'''
+    await op() # warm up the lazy imports and caches
+
+    times = []
+    for _ in range(repeat):
+        t = perf_counter()
+        await op()
+        times.append(perf_counter() - t)
+
+    tracemalloc.start()
+    await op()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return times, peak
+
+
+def sync(fn):
+    '''Wrap a plain function as a coroutine function so it can be measured'''
+    async def op():
+        return fn()
+    return op
+
+
+# ===== Benchmarks =====
+# Each one takes the size and a temp dir and returns the coroutine function to measure
+
+async def first_page(status, msg):
+    '''Query and render the first page, which is what the user waits for'''
+    response = await status.query(msg)
+    return response if isinstance(response, str) else response.page(0)
+
+def bench_query(n, tmp):
+    status = Status(fakes.content_db(n))
+    return lambda: first_page(status, 'status=Published, category=psyche')
+
+def bench_query_cold(n, tmp):
+    status = Status(fakes.content_db(n))
+    async def op():
+        status.cache.invalidate(0)
+        return await first_page(status, 'status=Published, category=psyche')
+    return op
+
+def bench_update(n, tmp):
+    db = fakes.content_db(n)
+    status = Status(db)
+    titles = [row[1] for row in db.get_worksheet(0).rows[1:]]
+    return lambda: status.update(f'title={random.choice(titles)}, status=Review')
+
+def bench_bulk_update(n, tmp):
+    db = fakes.content_db(n)
+    status = Status(db)
+    titles = [row[1] for row in db.get_worksheet(0).rows[1:]]
+    return lambda: status.bulk_update([f'title={title}, status=Review' for title in random.sample(titles, min(n, 20))])
+
+def bench_search(n, tmp):
+    status = Status(fakes.content_db(n))
+    return lambda: status.search('quantum bra')
+
+def bench_schedule(n, tmp):
+    scheduler = Scheduler(os.path.join(tmp, f'schedule-{n}.db'))
+    def op():
+        response, timestamps, post_details = scheduler.get_schedule('category=stem, title=Benchmark, date=10-10-2030')
+        return scheduler.get_reminders(timestamps, post_details)
+    return sync(op)
+
+def bench_bulk_schedule(n, tmp):
+    scheduler = Scheduler(os.path.join(tmp, f'bulk-{n}.db'))
+    start = datetime(2030, 1, 1)
+    records = [{'category': 'stem', 'title': f'Post {i}', 'date': f'{start + timedelta(days=i):%d-%m-%Y}'} for i in range(n)]
+    return sync(lambda: scheduler.bulk_schedule(records, now=start))
+
+def bench_check_similar(n, tmp):
+    titles = [row[1] for row in fakes.content_rows(n)]
+    return sync(lambda: check_similar(random.choice(titles), 'quantum brain music'))
+
+def bench_title_index(n, tmp):
+    index = TitleIndex(row[1] for row in fakes.content_rows(n))
+    return sync(lambda: index.top('quantum brain music', k=5))
+
+def command_stream(n, tmp):
+    '''n (schema, message) pairs of the commands that take col=val arguments'''
+    status = Status(fakes.content_db(10))
+    scheduler = Scheduler(os.path.join(tmp, f'stream-{n}.db'))
+    titles = [row[1] for row in fakes.content_rows(100)]
+    commands = [(status.query_args, lambda: 'status=Published, category=psyche'),
+                (status.add_args, lambda: f'name=ishaan, title={random.choice(titles)}, category=stem'),
+                (status.update_args, lambda: f'title={random.choice(titles)}, status=Review'),
+                (scheduler.schedule_args, lambda: 'category=stem, title=Benchmark, date=10-10-2030'),
+                (scheduler.remind_args, lambda: 'time=10-10-2030 18:30, msg=Post the reel')]
+    return [(schema, message()) for schema, message in random.choices(commands, k=n)]
+
+def parse_args(msg):
+    '''The argument parsing the commands used before schema.py, kept as the baseline. Needs `pip install parse`'''
+    import parse
+
+    # Get the argument pairs in a list
+    args = list(map(lambda x: x.strip(), msg.split(',')))
+    # Parse the arguments into a list of dicts
+    args = list(map(lambda x: parse.parse('{col}={val}', x), args))
+
+    return args
+
+def bench_parse_args(n, tmp):
+    messages = [message for _, message in command_stream(n, tmp)]
+    return sync(lambda: [parse_args(message) for message in messages])
+
+def bench_schema(n, tmp):
+    stream = command_stream(n, tmp)
+    return sync(lambda: [schema.parse(message) for schema, message in stream])
+
+def reminder_backlog(n, tmp, name):
+    store = ReminderStore(os.path.join(tmp, f'{name}-{n}.db'))
+    start = datetime(2030, 1, 1)
+    store.add([(start + timedelta(minutes=i), ['STEM Lab', f'Post {i}', 'Post', start]) for i in range(n)])
+    return store, start
+
+def bench_reminders_add(n, tmp):
+    store, start = reminder_backlog(n, tmp, 'add')
+    def op():
+        ids = store.add([(start + timedelta(hours=i), ['STEM Lab', 'New', 'Post', start]) for i in range(7)])
+        store.complete(ids)
+    return sync(op)
+
+def bench_reminders_load(n, tmp):
+    store, _ = reminder_backlog(n, tmp, 'load')
+    return sync(store.pending)
+
+
+BENCHMARKS = {'status.query': bench_query,
+              'status.query.cold': bench_query_cold,
+              'status.update': bench_update,
+              'status.bulk_update': bench_bulk_update,
+              'status.search': bench_search,
+              'scheduler.schedule': bench_schedule,
+              'scheduler.bulk': bench_bulk_schedule,
+              'utils.check_similar': bench_check_similar,
+              'utils.title_index': bench_title_index,
+              'parser.parse_args': bench_parse_args,
+              'parser.schema': bench_schema,
+              'reminders.add': bench_reminders_add,
+              'reminders.load': bench_reminders_load}
+
+
+async def run(names, sizes, repeat):
+    '''Returns {benchmark: {size: stats}}'''
+    # Commit writes right away instead of waiting for more to batch, the fake sheets have no quota
+    sheets.writes.window = 0
+    sheets.blocking.bucket = sheets.TokenBucket(rate=float('inf'), capacity=float('inf'))
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            results[name] = {}
+            for n in sizes:
+                op = BENCHMARKS[name](n, tmp)
+                times, peak = await measure(op, max(3, min(repeat, repeat * 1000 // n)))
+
+                results[name][str(n)] = {'p50': percentile(times, 50),
+                                         'p95': percentile(times, 95),
+                                         'p99': percentile(times, 99),
+                                         'peak_kb': peak / 1024,
+                                         'runs': len(times)}
+                print(f'[BENCH] {name} n={n} p50={results[name][str(n)]["p50"] * 1000:.3f}ms')
+
+    return results
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def report(results, baseline=None):
+    '''Returns the results as a table, with the change against the baseline results if given'''
+    columns = ['Benchmark', 'Rows', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Peak (KB)']
+    if baseline:
+        columns.append('p50 vs baseline')
+
+    table = PrettyTable(columns)
+    for name, by_size in results.items():
+        for n, stats in by_size.items():
+            row = [name, n, f"{stats['p50'] * 1000:.3f}", f"{stats['p95'] * 1000:.3f}",
+                   f"{stats['p99'] * 1000:.3f}", f"{stats['peak_kb']:.1f}"]
+
+            if baseline:
+                old = baseline.get(name, {}).get(n)
+                row.append(f"{(stats['p50'] / old['p50'] - 1) * 100:+.1f}%" if old else '-')
+
+            table.add_row(row)
+
+    return str(table)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the mods against a fake Content-DB')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50, help='runs per benchmark at 1000 rows, scaled by size')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--save', action='store_true', help='save the results to bench_results/<revision>.json')
+    parser.add_argument('--compare', help='results file of an earlier revision')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.only, args.sizes, args.repeat))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    print(report(results, baseline))
+
+    if args.save:
+        rev = revision()
+        os.makedirs('bench_results', exist_ok=True)
+        filename = os.path.join('bench_results', f'{rev}.json')
+        with open(filename, 'w') as f:
+            json.dump({'revision': rev, 'date': str(datetime.now()), 'results': results}, f, indent=2)
+        print(f'Saved to {filename}')
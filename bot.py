@@ -1,86 +1,295 @@
-import discord
-from discord.ext import commands
+from utils import PhaseTimer, load_numeric, split_entries
+startup = PhaseTimer()
+
+with startup.phase('import discord'):
+    import discord
+    from discord.ext import commands
+
+with startup.phase('import mods'):
+    from mods import Status, Scheduler, NewsBot, Minecraft
+    from sheets import connect, writes, blocking, WriteQueue
+    from mirror import Mirror
+    from metrics import metrics, monitor_loop_lag, serve
+    from supervisor import supervisor
+    import guilds as config_store
+
 import asyncio
-from mods import Status, Scheduler, NewsBot
+import csv
+import io
 import os
-from utils import update_reminders
 import random
-import requests
+import aiohttp
+from time import perf_counter
+
+class Merlin(commands.AutoShardedBot):
+
+    async def close(self):
+        # Stop the background jobs and commit the batched sheet writes before going offline
+        await supervisor.stop()
+        await asyncio.gather(*[guild.writes.flush() for guild in guilds.values()])
+        await mc.close()
+        await super().close()
+
+class Guild():
+    '''The mods of one server, with its own spreadsheet, caches and reminder queue'''
+
+    def __init__(self, config):
+        self.config = config
+
+        # One authorized spreadsheet handle shared by the mods
+        self.db = connect(name=config.spreadsheet)
+
+        # Local copy of the sheets, for when Google is slow or down, and the queue batching the writes to them
+        self.mirror = Mirror(config.mirror)
+        self.writes = WriteQueue(window=writes.window, mirror=self.mirror)
+
+        self.status = Status(self.db, self.mirror, config, self.writes)
+        self.scheduler = Scheduler(config=config)
+        self.newsbot = NewsBot(self.db, self.mirror, config, self.writes)
+
+    def start(self, bot):
+        '''Start the background jobs of the server, unless they are running already'''
+        job = f'mirror {self.config.id}'
+        interval = int(os.environ.get('MIRROR_SYNC_INTERVAL', 600))
+        supervisor.start(job, lambda: self.status.cache.run_mirror(self.writes, interval=interval, job=job))
+
+        supervisor.start(self.scheduler.job, lambda: self.scheduler.run_scheduler(bot))
+        supervisor.start(self.newsbot.job, lambda: self.newsbot.run(bot))
+
+# Init Discord, a process can run some of the shards with SHARD_COUNT and SHARD_IDS (eg: 0,1)
+shard_count = int(os.environ['SHARD_COUNT']) if 'SHARD_COUNT' in os.environ else None
+shard_ids = [int(shard) for shard in os.environ['SHARD_IDS'].split(',')] if 'SHARD_IDS' in os.environ else None
+if shard_ids is not None and shard_count is None:
+    raise ValueError('SHARD_IDS needs SHARD_COUNT, the number of shards across all the processes')
 
-# Init Discord
 intents = discord.Intents.default()
 intents.members = True
-bot = commands.Bot(command_prefix='--', description="Rubrix's Discord Assistant Bot", intents=intents)
+bot = Merlin(command_prefix='--', description="Rubrix's Discord Assistant Bot", intents=intents,
+             shard_count=shard_count, shard_ids=shard_ids)
+
+# Init the Mods of every server on the shards of this process
+with startup.phase('init servers'):
+    guilds = {} # server id -> Guild
+    for config in config_store.load(os.environ.get('GUILDS_FILE', 'guilds.json')):
+        if shard_ids is None or config_store.shard_of(config.id, shard_count) in shard_ids:
+            guilds[config.id] = Guild(config)
 
-# Init the Mods
-status = Status()
-scheduler = Scheduler()
-newsbot = NewsBot()
+    mc = Minecraft()
+
+def here(ctx):
+    '''The mods of the server a command came from'''
+    return guilds[ctx.guild.id]
 
 # ===== Run Background Tasks =====
 @bot.event
 async def on_ready():
-    print('Listening...')
-    # Scheduler
-    scheduler_task = asyncio.create_task(scheduler.run_scheduler(bot))
-    # Newsbot
-    newsbot_task = asyncio.create_task(newsbot.run(bot))
-    
-    await scheduler_task
-    await newsbot_task
+    # Only the first on_ready is part of the startup, it fires again on reconnects
+    if not startup.done:
+        startup.lap('discord connect')
+        startup.done = True
+        print(startup.report())
+
+    # One instance of each job, so the reconnects don't start duplicates
+    supervisor.start('loop lag', monitor_loop_lag)
+    if 'METRICS_PORT' in os.environ:
+        supervisor.start('metrics', lambda: serve(int(os.environ['METRICS_PORT'])))
+
+    # Import the libraries for matching titles in the background, they take seconds on the Pi
+    load_numeric()
+
+    # Mirror sync, reminders and news of every server
+    for guild in guilds.values():
+        guild.start(bot)
+
+    print(f'Listening on {len(guilds)} servers...')
 
 @bot.event
 async def on_member_remove(member):
-    status.member_remove(member)
+    if member.guild.id in guilds:
+        await guilds[member.guild.id].status.member_remove(member)
+
+@bot.check
+async def configured(ctx):
+    '''Commands only work in the servers Merlin is set up for'''
+    return ctx.guild is not None and ctx.guild.id in guilds
+
+@bot.before_invoke
+async def start_timer(ctx):
+    ctx.started = perf_counter()
+
+@bot.after_invoke
+async def record_latency(ctx):
+    observe_latency(ctx)
+
+def observe_latency(ctx):
+    '''Record how long a command took to reply, once. Paged results count until their first page is sent,
+    not the wait for reactions'''
+    if getattr(ctx, 'started', None) is not None and not getattr(ctx, 'observed', False):
+        ctx.observed = True
+        metrics.observe('command_seconds', perf_counter() - ctx.started, command=ctx.command.name)
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(getattr(error, 'original', error), asyncio.TimeoutError):
+        await ctx.channel.send("Google Sheets is taking too long to respond, try again in a bit")
+    elif isinstance(error, commands.CheckFailure):
+        await ctx.channel.send("Merlin isn't set up for this server yet")
+    else:
+        raise error
     
 
+async def send_pages(ctx, pages, timeout=120):
+    '''Send the first page right away and flip through the rest with reactions'''
+    num = 0
+    message = await ctx.channel.send(pages.page(num))
+    observe_latency(ctx)
+    if pages.count < 2:
+        return
+
+    arrows = ['◀️', '▶️']
+    for arrow in arrows:
+        await message.add_reaction(arrow)
+
+    def check(reaction, user):
+        return reaction.message.id == message.id and str(reaction.emoji) in arrows and not user.bot
+
+    while True:
+        try:
+            reaction, user = await bot.wait_for('reaction_add', timeout=timeout, check=check)
+        except asyncio.TimeoutError:
+            break
+
+        step = 1 if str(reaction.emoji) == '▶️' else -1
+        if 0 <= num + step < pages.count:
+            num += step
+            await message.edit(content=pages.page(num))
+
+        # Let the same arrow be pressed again, needs the Manage Messages permission
+        try:
+            await message.remove_reaction(reaction.emoji, user)
+        except discord.Forbidden:
+            pass
+
+    try:
+        await message.clear_reactions()
+    except discord.Forbidden:
+        pass
+
+
 # ===== Status Sheet Commands =====
 @bot.command(aliases=['q'])
 async def query(ctx, *, args):
-    response = status.query(args)
+    response = await here(ctx).status.query(args)
+    if isinstance(response, str):
+        await ctx.channel.send(response)
+    else:
+        await send_pages(ctx, response)
+    
+@bot.command(aliases=['find'])
+async def search(ctx, *, args):
+    response = await here(ctx).status.search(args)
     print(response)
     await ctx.channel.send(response)
-    
+
 @bot.command(aliases=['a'])
 async def add(ctx, *, args):
-    response = status.add(args)
+    response = await here(ctx).status.add(args)
     print(response)
     await ctx.channel.send(response)
 
 @bot.command(aliases=['u'])
 async def update(ctx, *, args):
-    response = status.update(args)
+    response = await here(ctx).status.update(args)
     print(response)
     await ctx.channel.send(response)
 
+async def read_entries(ctx, args):
+    '''The entries of a bulk command, from the message and an attached text file'''
+    text = args
+    if ctx.message.attachments:
+        text += '\n' + (await ctx.message.attachments[0].read()).decode('utf-8-sig')
+    return split_entries(text)
+
+@bot.command(aliases=['ba'])
+async def bulk_add(ctx, *, args=''):
+    '''Add many entries, one per line or separated by ;'''
+    entries = await read_entries(ctx, args)
+    if not entries:
+        await ctx.channel.send("That command doesn't seem right?!")
+        return
+    await send_pages(ctx, await here(ctx).status.bulk_add(entries))
+
+@bot.command(aliases=['bu'])
+async def bulk_update(ctx, *, args=''):
+    '''Update many statuses, one per line or separated by ;'''
+    entries = await read_entries(ctx, args)
+    if not entries:
+        await ctx.channel.send("That command doesn't seem right?!")
+        return
+    response = await here(ctx).status.bulk_update(entries)
+    if isinstance(response, str):
+        await ctx.channel.send(response)
+    else:
+        await send_pages(ctx, response)
+
+@bot.command()
+async def refresh(ctx):
+    '''Drop the cached Content-DB sheets'''
+    response = here(ctx).status.refresh()
+    await ctx.channel.send(response)
+
 # ===== Scheduling Commands =====
 @bot.command(aliases=['r'])
 async def remind(ctx, *, args):
-    t_delta, params = scheduler.remind(args)
+    t_remind, params = here(ctx).scheduler.remind(args)
         
-    if t_delta != -1:
+    if t_remind != -1:
+        # Handed over to the background scheduler, which survives restarts
+        await here(ctx).scheduler.push([(t_remind, {'channel': ctx.channel.id, 'msg': params['msg']})])
         await ctx.channel.send(f"Will remind you to \"{params['msg']}\" at {params['time']}")
-
-        print('Timeout for', t_delta, 'seconds')
-        await asyncio.sleep(int(t_delta))
-        print('Timeout Complete')
-
-        await ctx.channel.send(f"**Reminder:** {params['msg']}")
     else:
         await ctx.channel.send(params)
 
 @bot.command(aliases=['s'])
 async def schedule(ctx, *, args):
     # Add to schedule and extract datetime objects
-    response, timestamps, post_details = scheduler.get_schedule(args)
+    response, timestamps, post_details = here(ctx).scheduler.get_schedule(args)
 
     if timestamps != -1 and post_details != -1:
         # Get reminders
-        reminders = scheduler.get_reminders(timestamps, post_details)
-        # Save reminders
-        update_reminders(reminders)
+        reminders = here(ctx).scheduler.get_reminders(timestamps, post_details)
+        # Queue and save reminders
+        await here(ctx).scheduler.add_reminders(reminders)
         
     await ctx.channel.send(response)
+
+@bot.command(aliases=['sb'])
+async def bulk_schedule(ctx, worksheet='Calendar'):
+    '''Schedule a content calendar from an attached CSV or a worksheet, with category, title and date columns'''
+    from gspread.exceptions import WorksheetNotFound
+
+    try:
+        if ctx.message.attachments:
+            text = (await ctx.message.attachments[0].read()).decode('utf-8-sig')
+            records = list(csv.DictReader(io.StringIO(text)))
+        else:
+            sheet = await blocking.request(here(ctx).db.worksheet, worksheet)
+            values = await blocking.request(sheet.get_all_values)
+            records = [dict(zip(values[0], row)) for row in values[1:]] if values else []
+    except (UnicodeDecodeError, csv.Error, WorksheetNotFound) as e:
+        print('[SCHEDULE]', repr(e))
+        await ctx.channel.send(f"Couldn't read the calendar, attach a CSV or make a `{worksheet}` worksheet")
+        return
+
+    response, entries = here(ctx).scheduler.bulk_schedule(records)
+    if entries:
+        # Every reminder of the calendar in one transaction
+        await here(ctx).scheduler.push(entries)
+
+    if isinstance(response, str):
+        await ctx.channel.send(response)
+    else:
+        await send_pages(ctx, response)
     
 
 @bot.command(aliases=['mc'])
@@ -89,10 +298,30 @@ async def minecraft(ctx, cmd):
     if cmd.lower() not in ['start', 'stop', 'status']:
         return
     
-    resp = requests.post('https://at9x4tzxhe.execute-api.us-east-1.amazonaws.com/', json=cmd.lower()).json()
+    try:
+        resp = await mc.command(cmd.lower())
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print('[MC]', repr(e))
+        await ctx.channel.send("`Couldn't reach the Minecraft Server, try again in a bit`")
+        return
+
     await ctx.channel.send(f"`Minecraft Server Status: {resp.capitalize()}`")
 
 
+@bot.command()
+async def stats(ctx):
+    '''Runtime latency and Google Sheets call stats'''
+    table = metrics.summary()
+    if len(table) > 1900:
+        table = table[:1900].rsplit('\n', 1)[0] + '\n...'
+    await ctx.channel.send(f"**Merlin Stats**\n```\n{table}\n```")
+
+@bot.command()
+async def health(ctx):
+    '''State of the background jobs'''
+    await ctx.channel.send(f"**Merlin Health**\n```\n{supervisor.health()}\n```")
+
+
 # ===== Experimental Commands =====
 @bot.command()
 async def echo(ctx, *, args):
@@ -106,5 +335,6 @@ async def ping(ctx):
 
 # =================================
 # Run the bot
-token = os.environ['DISCORD']
-bot.run(token)
\ No newline at end of file
+if __name__ == '__main__':
+    token = os.environ['DISCORD']
+    bot.run(token)
@@ -0,0 +1,117 @@
+'''In-memory stand-ins for the gspread objects, for running the mods offline'''
+import random
+import time
+from itertools import count
+
+from gspread.utils import a1_to_rowcol
+
+
+class FakeWorksheet():
+    '''Implements the part of the gspread Worksheet API used by the mods'''
+
+    ids = count()
+
+    def __init__(self, header, rows=(), latency=0):
+        self.id = next(self.ids)
+        self.rows = [list(header)] + [list(row) for row in rows]
+        self.latency = latency # seconds every call blocks for, like a Sheets round-trip
+        self.calls = 0
+        self.version = 0 # bumped on every write
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_all_values(self):
+        self._call()
+        return [list(row) for row in self.rows]
+
+    def row_values(self, row):
+        self._call()
+        return list(self.rows[row - 1])
+
+    def batch_get(self, ranges, **kwargs):
+        '''Single cell ranges only, empty cells come back as [] like gspread's'''
+        self._call()
+        values = []
+        for a1 in ranges:
+            row, col = a1_to_rowcol(a1)
+            value = self.rows[row - 1][col - 1] if row <= len(self.rows) and col <= len(self.rows[row - 1]) else ''
+            values.append([[value]] if value != '' else [])
+        return values
+
+    def append_row(self, values, **kwargs):
+        self._call()
+        self.rows.append(list(values))
+        self.version += 1
+
+    def append_rows(self, values, **kwargs):
+        self._call()
+        self.rows.extend(list(row) for row in values)
+        self.version += 1
+
+    def update_cell(self, row, col, value):
+        self._call()
+        self._set(row, col, value)
+
+    def batch_update(self, data, **kwargs):
+        self._call()
+        for update in data:
+            row, col = a1_to_rowcol(update['range'])
+            self._set(row, col, update['values'][0][0])
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([''] * len(self.rows[0]))
+        self.rows[row - 1][col - 1] = value
+        self.version += 1
+
+
+class FakeSpreadsheet():
+    '''Stand-in for the Content-DB spreadsheet returned by sheets.connect'''
+
+    def __init__(self, worksheets):
+        self.id = 'fake-content-db'
+        self.worksheets = list(worksheets)
+        for idx, sheet in enumerate(self.worksheets):
+            sheet.index = idx
+
+    def get_worksheet(self, idx):
+        return self.worksheets[idx]
+
+    def get_lastUpdateTime(self):
+        return str(sum(sheet.version for sheet in self.worksheets))
+
+
+# ===== Synthetic Data =====
+WORDS = ['climate', 'quantum', 'music', 'history', 'future', 'brain', 'money', 'space',
+         'ocean', 'art', 'data', 'city', 'food', 'sleep', 'memory', 'language', 'energy',
+         'games', 'design', 'ethics', 'health', 'cinema', 'crypto', 'forest', 'robots']
+NAMES = ['Anushk', 'Anshita', 'Somaditya', 'Bhavesh', 'Ishaan', 'Mriganka', 'Nandini',
+         'Piyush', 'Dhwaj', 'Divya', 'Kushagra', 'Shreyas', 'Rishabh']
+STATUSES = ['Proposed', 'Writing', 'Review', 'Designing', 'Scheduled', 'Published']
+CATEGORIES = ['Fringe Bureau', 'Psyche', 'STEM Lab', 'Mint Affairs', 'Footprints', 'Inspire', 'YOLO']
+
+
+def content_rows(n, seed=0):
+    '''Returns n random [name, title, status, category] rows'''
+    rng = random.Random(seed)
+    return [[rng.choice(NAMES),
+             ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 7))).capitalize() + f' {i}',
+             rng.choice(STATUSES),
+             rng.choice(CATEGORIES)] for i in range(n)]
+
+
+def link_rows(n, seed=0):
+    '''Returns n random [link, caption, isDone] rows'''
+    rng = random.Random(seed)
+    return [[f'https://example.com/{i}', rng.choice(['', 'Thoughts?']), rng.choice(['', '1'])]
+            for i in range(n)]
+
+
+def content_db(n=1000, links=100, latency=0, seed=0):
+    '''Returns a fake Content-DB with n content rows'''
+    return FakeSpreadsheet([FakeWorksheet(['Name', 'Title', 'Status', 'Category'], content_rows(n, seed), latency),
+                            FakeWorksheet(['Link', 'Caption', 'isDone'], link_rows(links, seed), latency),
+                            FakeWorksheet(['ID', 'Name', 'Time'], [], latency)])
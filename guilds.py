@@ -0,0 +1,105 @@
+'''Per server settings, loaded from a JSON list in guilds.json (or GUILDS_FILE), eg:
+
+    [{"id": 737282578117034004},
+     {"id": 123456789012345678, "name": "Other", "spreadsheet": "Other-DB",
+      "channels": {"publishing": 1, "discussions": 2}, "roles": {"writer": 3, "designer": 4}}]
+
+The first server falls back on the settings of Rubrix, the others have to give their own spreadsheet,
+channels and roles.
+'''
+import json
+import os
+
+from schema import Aliases
+
+# Rubrix, the server Merlin was written for, used when there is no config file
+DEFAULT = {'id': 737282578117034004,
+           'name': 'Rubrix',
+           'spreadsheet': 'Content-DB',
+           'channels': {'publishing': 755142334496243892,
+                        'discussions': 754337556023345223,
+                        'bot-testing-zone': 755079000962891891},
+           'roles': {'writer': 747703681985544202,
+                     'designer': 747703676587737229},
+           'writers': ['anushk', 'anshita', 'somaditya',
+                       'bhavesh', 'ishaan', 'mriganka',
+                       'nandini', 'piyush', 'dhwaj', 'divya',
+                       'kushagra', 'shreyas', 'rishabh'],
+           'cat_map': {'fringe': 'Fringe Bureau',
+                       'psyche': 'Psyche',
+                       'stem': 'STEM Lab',
+                       'mint': 'Mint Affairs',
+                       'footprints': 'Footprints',
+                       'inspire': 'Inspire',
+                       'yolo': 'YOLO'},
+           'newsbot_timings': ['18:00']}
+
+# Defaults that aren't specific to Rubrix, so every server gets them
+SHARED = ['cat_map', 'newsbot_timings']
+
+# What a server other than the first must set, as key or key.subkey
+REQUIRED = ['spreadsheet', 'channels.publishing', 'channels.discussions', 'roles.writer', 'roles.designer']
+
+
+class GuildConfig():
+    '''Settings of one Discord server, anything left out is taken from the default'''
+
+    def __init__(self, settings, primary=False):
+        # Only the first server may fall back on Rubrix's own spreadsheet, ids and writers
+        defaults = DEFAULT if primary else {key: DEFAULT[key] for key in SHARED}
+        merged = {**defaults, **settings}
+        for key in ('channels', 'roles'):
+            # One level deeper, so giving one channel doesn't drop the others
+            merged[key] = {**defaults.get(key, {}), **settings.get(key, {})}
+        settings = merged
+
+        self.id = int(settings['id'])
+        self.name = settings.get('name', str(self.id))
+        self.spreadsheet = settings['spreadsheet']
+        # Local copy of the spreadsheet, the first server keeps the file from before there were several
+        self.mirror = settings.get('mirror', 'content.db' if primary else f'content-{self.id}.db')
+        self.channels = {name: int(channel) for name, channel in settings['channels'].items()}
+        self.roles = {name: int(role) for name, role in settings['roles'].items()}
+        self.writers = settings.get('writers', [])
+        self.cat_map = settings['cat_map']
+        self.categories = Aliases(self.cat_map) # normalizes the shorthands and names of the categories
+        self.newsbot_timings = settings['newsbot_timings']
+
+        # The first server owns the reminders saved before there were several
+        self.primary = primary
+
+    def mention(self, role):
+        return f'<@&{self.roles[role]}>'
+
+
+def load(filename='guilds.json'):
+    '''Returns the configs of the servers in the config file, or of Rubrix if there is none'''
+    if not os.path.exists(filename):
+        return [GuildConfig({}, primary=True)]
+
+    with open(filename) as f:
+        settings = json.load(f)
+
+    for i, s in enumerate(settings):
+        if 'id' not in s:
+            raise ValueError(f'Server {i + 1} in {filename} has no id')
+
+        missing = [key for key in REQUIRED if i > 0 and not has(s, key)]
+        if missing:
+            raise ValueError(f'Server {i + 1} in {filename} has no {", ".join(missing)}')
+
+    return [GuildConfig(s, primary=(i == 0)) for i, s in enumerate(settings)]
+
+
+def has(settings, key):
+    '''Whether key, or section.key for the channels and roles, is set'''
+    section, _, name = key.partition('.')
+    value = settings.get(section)
+    if not name:
+        return bool(value)
+    return isinstance(value, dict) and value.get(name) is not None
+
+
+def shard_of(guild_id, shard_count):
+    '''The shard Discord connects a server through'''
+    return (guild_id >> 22) % shard_count
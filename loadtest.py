@@ -0,0 +1,219 @@
+'''Offline load test of the bot commands, with stand-ins for Discord and the Content-DB in fakes.py
+
+    python loadtest.py --requests 2000 --concurrency 200 --latency 0.3
+    python loadtest.py --mix query=8 update=1 --quota 1000 --window 0.1
+
+Needs no Discord token or Google credentials, everything it writes goes to a temp dir.
+'''
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from itertools import count
+from time import perf_counter
+
+from prettytable import PrettyTable
+
+import fakes
+from utils import load_numeric
+
+
+# ===== Discord Stand-ins =====
+class FakeMessage():
+
+    ids = count(1)
+
+    def __init__(self, channel, content='', attachments=()):
+        self.id = next(self.ids)
+        self.channel = channel
+        self.content = content
+        self.attachments = list(attachments)
+
+    async def add_reaction(self, emoji):
+        await self.channel.delay()
+
+    async def edit(self, content):
+        await self.channel.delay()
+        self.content = content
+
+    async def clear_reactions(self):
+        await self.channel.delay()
+
+    async def delete(self):
+        await self.channel.delay()
+
+
+class FakeChannel():
+    '''Records what the bot sends, taking latency seconds per API call like Discord would'''
+
+    def __init__(self, latency=0):
+        self.id = 755142334496243892
+        self.latency = latency
+        self.sent = 0
+
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send(self, content):
+        await self.delay()
+        self.sent += 1
+        return FakeMessage(self, content)
+
+
+class FakeGuild():
+
+    def __init__(self, id):
+        self.id = id
+
+
+class FakeContext():
+    '''The part of commands.Context the command handlers use'''
+
+    def __init__(self, guild, channel, command, content):
+        self.guild = guild
+        self.channel = channel
+        self.command = command
+        self.message = FakeMessage(channel, content)
+
+
+# ===== Workload =====
+def workload(titles, start):
+    '''Returns {command: function of the invocation number returning its args}'''
+    return {'query': lambda i: 'status=Published, category=psyche',
+            'add': lambda i: f'name=ishaan, title=Load test {i}, category=stem',
+            'update': lambda i: f'title={random.choice(titles)}, status=Review',
+            'remind': lambda i: f"time={start + timedelta(days=1, minutes=i):%d-%m-%Y %H:%M}, msg=Load test {i}",
+            'schedule': lambda i: f"category=stem, title=Load test {i}, date={start + timedelta(days=3 + i % 300):%d-%m-%Y}"}
+
+
+async def monitor_lag(samples, interval=0.01):
+    '''Records how late every short sleep wakes up, ie: how long the loop was blocked'''
+    loop = asyncio.get_running_loop()
+    while True:
+        t = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0, loop.time() - t - interval))
+
+
+async def run(merlin, db, args):
+    '''Returns {command: latencies}, {command: errors}, the loop lag samples, the wall time and the messages sent'''
+    bot = merlin.bot
+
+    # Nobody reacts to the paged results, so send_pages returns right away
+    async def wait_for(event, timeout=None, check=None):
+        raise asyncio.TimeoutError
+    bot.wait_for = wait_for
+
+    # The commands all come from the first configured server
+    guild = FakeGuild(next(iter(merlin.guilds)))
+    channel = FakeChannel(args.discord_latency)
+    titles = [row[1] for row in db.get_worksheet(0).rows[1:]]
+    make_args = workload(titles, datetime.now())
+
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    plan = random.choices(names, weights, k=args.requests)
+
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def invoke(i, name):
+        command = bot.get_command(name)
+        text = make_args[name](i)
+        ctx = FakeContext(guild, channel, command, f'--{name} {text}')
+
+        async with gate:
+            t = perf_counter()
+            try:
+                await command.callback(ctx, args=text)
+            except Exception as e:
+                errors[name] += 1
+                if errors[name] == 1:
+                    print(f'[LOAD] {name} failed with {e!r}', file=sys.stderr)
+            latencies[name].append(perf_counter() - t)
+
+    # on_ready doesn't fire here, so import what it warms up before the clock starts
+    await load_numeric()
+
+    lag = []
+    monitor = asyncio.create_task(monitor_lag(lag))
+
+    t = perf_counter()
+    await asyncio.gather(*[invoke(i, name) for i, name in enumerate(plan)])
+    await asyncio.gather(*[g.writes.flush() for g in merlin.guilds.values()])
+    elapsed = perf_counter() - t
+
+    monitor.cancel()
+    return latencies, errors, lag, elapsed, channel.sent
+
+
+def report(latencies, errors, lag, elapsed, sent, db):
+    table = PrettyTable(['Command', 'Runs', 'Errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'Max (ms)'])
+    for name, times in latencies.items():
+        if not times:
+            continue
+        table.add_row([name, len(times), errors[name]] +
+                      [f'{percentile(times, q) * 1000:.1f}' for q in (50, 95, 99)] + [f'{max(times) * 1000:.1f}'])
+
+    total = sum(len(times) for times in latencies.values())
+    calls = sum(sheet.calls for sheet in db.worksheets)
+
+    lines = [str(table),
+             f'Throughput: {total / elapsed:.1f} commands/s ({total} in {elapsed:.2f}s)',
+             f'Event loop lag: p99 {percentile(lag, 99) * 1000:.1f}ms, max {max(lag) * 1000:.1f}ms' if lag else 'Event loop lag: no samples',
+             f'Sheets calls: {calls}, Discord messages: {sent}']
+    return '\n'.join(lines)
+
+
+def mix(text):
+    name, _, weight = text.partition('=')
+    return name, float(weight or 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the bot commands against fake Discord and Content-DB')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100, help='commands in flight at once')
+    parser.add_argument('--rows', type=int, default=1000, help='rows in the fake content sheet')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds every Sheets call takes')
+    parser.add_argument('--discord-latency', type=float, default=0.05, help='seconds every Discord call takes')
+    parser.add_argument('--mix', type=mix, nargs='+', default=[('query', 5), ('add', 1), ('update', 2), ('remind', 1), ('schedule', 1)],
+                        help='command=weight pairs')
+    parser.add_argument('--quota', type=int, help='Sheets requests per minute, defaults to SHEETS_QUOTA')
+    parser.add_argument('--window', type=float, help='write batching window, defaults to SHEETS_WRITE_WINDOW')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own output")
+    args = parser.parse_args()
+    args.mix = dict(args.mix)
+    random.seed(args.seed)
+
+    # The mods read their config and create their files on import, so set those up first
+    if args.quota is not None:
+        os.environ['SHEETS_QUOTA'] = str(args.quota)
+    if args.window is not None:
+        os.environ['SHEETS_WRITE_WINDOW'] = str(args.window)
+
+    tmp = tempfile.TemporaryDirectory()
+    os.chdir(tmp.name)
+
+    # benchmark imports the mods too
+    from benchmark import percentile
+    import sheets
+    db = fakes.content_db(args.rows, latency=args.latency, seed=args.seed)
+    sheets.connect = lambda *a, **kw: db
+
+    # The commands print their responses, which would bury the report
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+        import bot
+        results = asyncio.run(run(bot, db, args))
+
+    print(report(*results, db))
+
+    tmp.cleanup()
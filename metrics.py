@@ -0,0 +1,147 @@
+import asyncio
+import bisect
+from contextlib import contextmanager
+from time import perf_counter
+
+from prettytable import PrettyTable
+
+
+class Histogram():
+    '''Cumulative latency histogram with fixed buckets, in seconds'''
+
+    buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1) # the last one is +Inf
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        '''Upper bound of the bucket holding the q-th percentile'''
+        rank = q / 100 * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics():
+    '''Registry of the runtime histograms, counters and gauges'''
+
+    def __init__(self):
+        self.histograms = {} # (name, labels) -> Histogram
+        self.counters = {} # (name, labels) -> count
+        self.gauges = {} # (name, labels) -> value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - t, **labels)
+
+    def inc(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def summary(self):
+        '''Returns a table of the metrics, for the --stats command'''
+        table = PrettyTable(['Metric', 'Count', 'Avg (ms)', 'p95 (ms)', 'Max (ms)'])
+        table.align['Metric'] = 'l'
+
+        for key, hist in sorted(self.histograms.items()):
+            table.add_row([_name(key), hist.count, f'{hist.sum / hist.count * 1000:.1f}',
+                           f'{hist.percentile(95) * 1000:.1f}', f'{hist.max * 1000:.1f}'])
+        for key, value in sorted(self.counters.items()):
+            table.add_row([_name(key), value, '', '', ''])
+        for key, value in sorted(self.gauges.items()):
+            table.add_row([_name(key), value, '', '', ''])
+
+        return str(table)
+
+    def prometheus(self):
+        '''Returns the metrics in the Prometheus text exposition format'''
+        lines = []
+
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (series, labels), hist in sorted(self.histograms.items()):
+                if series != name:
+                    continue
+                seen = 0
+                for bound, n in zip([str(b) for b in Histogram.buckets] + ['+Inf'], hist.counts):
+                    seen += n
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {seen}')
+                lines.append(f'{name}_sum{_labels(labels)} {hist.sum}')
+                lines.append(f'{name}_count{_labels(labels)} {hist.count}')
+
+        for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+            for name in sorted({name for name, _ in series}):
+                lines.append(f'# TYPE {name} {kind}')
+                for (series_name, labels), value in sorted(series.items()):
+                    if series_name == name:
+                        lines.append(f'{name}{_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+def _name(key):
+    name, labels = key
+    return name + ''.join(f' {v}' for _, v in labels)
+
+
+# Shared by all the mods
+metrics = Metrics()
+
+
+async def monitor_loop_lag(interval=1):
+    '''Records how late the event loop wakes up from a sleep, ie: how long something blocked it'''
+    loop = asyncio.get_running_loop()
+    while True:
+        t = loop.time()
+        await asyncio.sleep(interval)
+        metrics.observe('event_loop_lag_seconds', max(0, loop.time() - t - interval))
+
+
+async def serve(port, host='127.0.0.1'):
+    '''Serve the metrics over HTTP for Prometheus to scrape'''
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            body = metrics.prometheus().encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                         + f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f'Serving metrics on http://{host}:{port}/metrics')
+    async with server:
+        await server.serve_forever()
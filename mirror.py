@@ -0,0 +1,123 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+
+class Mirror():
+    '''Local SQLite copy of the Content-DB worksheets, kept in sync by diffing row hashes'''
+
+    # worksheet index -> (table, columns)
+    schemas = {0: ('content', ['name', 'title', 'status', 'category']),
+               1: ('links', ['link', 'caption', 'isDone']),
+               2: ('leavers', ['id', 'name', 'time'])}
+
+    def __init__(self, filename='content.db'):
+        # Calls come from the local thread in sheets.py, so the connection is shared behind a lock
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+
+            for table, columns in self.schemas.values():
+                cols = ', '.join(f'"{col}" TEXT NOT NULL' for col in columns)
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (row INTEGER PRIMARY KEY, hash TEXT NOT NULL, {cols})')
+
+            # Reads take whole tables in row order, so column indexes only slowed down the syncs of older files
+            for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall():
+                self.conn.execute(f'DROP INDEX "{name}"')
+
+            # Writes that couldn't reach the sheet yet, replayed in order
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                                     id INTEGER PRIMARY KEY,
+                                     sheet INTEGER NOT NULL,
+                                     kind TEXT NOT NULL,
+                                     op TEXT NOT NULL)''')
+
+    @staticmethod
+    def _hash(values):
+        return hashlib.sha1('\x1f'.join(values).encode()).hexdigest()
+
+    def _fit(self, idx, values):
+        n = len(self.schemas[idx][1])
+        return (list(values) + [''] * n)[:n]
+
+    def sync(self, idx, rows):
+        '''Mirror the rows (without the header) of a worksheet, rewriting only the rows that changed'''
+        table, columns = self.schemas[idx]
+        rows = [self._fit(idx, values) for values in rows]
+
+        with self.lock, self.conn:
+            stored = dict(self.conn.execute(f'SELECT row, hash FROM {table}'))
+
+            changed = []
+            for num, values in enumerate(rows, start=2): # sheet row numbers, after the header
+                digest = self._hash(values)
+                if stored.get(num) != digest:
+                    changed.append((num, digest, *values))
+
+            cols = ', '.join(f'"{col}"' for col in columns)
+            marks = ', '.join('?' * (len(columns) + 2))
+            self.conn.executemany(f'INSERT OR REPLACE INTO {table} (row, hash, {cols}) VALUES ({marks})', changed)
+            self.conn.execute(f'DELETE FROM {table} WHERE row > ?', (len(rows) + 1,))
+
+        if changed:
+            print(f'[MIRROR] {len(changed)} rows of {table} changed')
+
+        return len(changed)
+
+    def rows(self, idx):
+        '''Returns the mirrored rows of a worksheet, in sheet order'''
+        table, columns = self.schemas[idx]
+        cols = ', '.join(f'"{col}"' for col in columns)
+
+        with self.lock:
+            return [list(values) for values in self.conn.execute(f'SELECT {cols} FROM {table} ORDER BY row')]
+
+    def has(self, idx):
+        table = self.schemas[idx][0]
+        with self.lock:
+            return self.conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() is not None
+
+    def queue(self, idx, kind, ops):
+        '''Save writes to be replayed later and apply them to the mirror so reads see them'''
+        table, columns = self.schemas[idx]
+
+        with self.lock, self.conn:
+            self.conn.executemany('INSERT INTO outbox (sheet, kind, op) VALUES (?, ?, ?)',
+                                  [(idx, kind, json.dumps(op)) for op in ops])
+
+            for op in ops:
+                if kind == 'append':
+                    self._append(idx, op)
+                else:
+                    row, col, value = op
+                    # Stale hash, so the next sync rewrites the row with whatever the sheet has
+                    self.conn.execute(f'UPDATE {table} SET "{columns[col - 1]}" = ?, hash = \'\' WHERE row = ?', (value, row))
+
+    def append(self, idx, rows):
+        '''Mirror rows appended to a worksheet, for the ones that are written but never downloaded'''
+        with self.lock, self.conn:
+            for values in rows:
+                self._append(idx, values)
+
+    def _append(self, idx, values):
+        table, columns = self.schemas[idx]
+        values = self._fit(idx, values)
+        last = self.conn.execute(f'SELECT MAX(row) FROM {table}').fetchone()[0] or 1
+        cols = ', '.join(f'"{col}"' for col in columns)
+        marks = ', '.join('?' * (len(columns) + 2))
+        self.conn.execute(f'INSERT INTO {table} (row, hash, {cols}) VALUES ({marks})',
+                          (last + 1, self._hash(values), *values))
+
+    def outbox(self):
+        '''Returns the queued writes as (id, worksheet index, kind, op), oldest first'''
+        with self.lock:
+            rows = self.conn.execute('SELECT id, sheet, kind, op FROM outbox ORDER BY id').fetchall()
+        return [(i, idx, kind, json.loads(op)) for i, idx, kind, op in rows]
+
+    def sent(self, ids):
+        '''Drop the writes that reached the sheet'''
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in ids])
@@ -1,126 +1,175 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-
-import pandas as pd
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-
 from prettytable import PrettyTable
 from time import time
-import parse
 import random
 from datetime import datetime, timedelta
 from pytz import timezone
 import asyncio
+import os
+import discord
+from collections import deque
+from time import monotonic
 
 from utils import *
+from sheets import SheetCache, blocking, run_local, writes, unreachable
+from reminders import ReminderQueue, ReminderStore
+from table import ContentTable, Paginator, TableFormatter
+from search import SearchIndex
+from metrics import metrics
+from supervisor import supervisor
+from guilds import GuildConfig
+from schema import Schema, Text, Choice, Date, ArgsError, DATE
+
+# Appended to responses when a write had to be queued in the mirror
+QUEUED_NOTE = "\n*Google Sheets is unreachable right now, the change is saved and will be written once it's back*"
 
 class Status():
 
-    def __init__(self):
-        self.scope = ["https://spreadsheets.google.com/feeds",
-                      "https://www.googleapis.com/auth/spreadsheets",
-                      "https://www.googleapis.com/auth/drive.file",
-                      "https://www.googleapis.com/auth/drive"]
-        self.creds = ServiceAccountCredentials.from_json_keyfile_name("creds.json", self.scope)
-        self.gclient = gspread.authorize(self.creds)
-
-        self.writers = ['anushk', 'anshita', 'somaditya',
-                        'bhavesh', 'ishaan', 'mriganka',
-                        'nandini', 'piyush', 'dhwaj', 'divya',
-                        'kushagra', 'shreyas', 'rishabh']
-
-        # Load Spreadsheet
-        self.db = self.gclient.open("Content-DB")
-
-        # Category shorthands
-        self.cat_map = {'fringe': 'Fringe Bureau',
-                        'psyche': 'Psyche',
-                        'stem': 'STEM Lab',
-                        'mint': 'Mint Affairs',
-                        'footprints': 'Footprints',
-                        'inspire': 'Inspire',
-                        'yolo': 'YOLO'}
-
-    def member_remove(self, member):
+    def __init__(self, db, mirror=None, config=None, writes=writes):
+        # Settings of the server, Rubrix if not given
+        self.config = config or GuildConfig({}, primary=True)
+        self.writers = self.config.writers
+
+        # Content-DB spreadsheet of the server
+        self.db = db
+
+        # Snapshot cache of the worksheets, and the queue that batches the writes to them
+        self.cache = SheetCache(self.db, ttl=int(os.environ.get('SHEET_CACHE_TTL', 300)), mirror=mirror)
+        self.writes = writes
+
+        # Similarity index over the titles of the content sheet
+        self.titles = TitleIndex()
+
+        # Indexed table of the content sheet, rebuilt when the snapshot changes
+        self.table = ContentTable()
+
+        # Full-text index of the content sheet, updated incrementally
+        self.search_index = SearchIndex()
+
+        # Arguments of the commands, compiled once
+        categories = self.config.categories
+        self.query_args = Schema(Text('name'), Text('title'), Text('status'), Choice('category', categories),
+                                 unknown='error', usage='--query status=Writing, category=stem')
+        self.add_args = Schema(Text('name'), Text('title', case=None), Text('status'), Choice('category', categories),
+                               at_least=2, usage='--add name=..., title=..., category=stem')
+        self.update_args = Schema(Text('title', case=None), Text('status'), required=['title', 'status'],
+                                  usage='--update title=..., status=Review')
+
+    async def member_remove(self, member):
         '''Member Removed/Left'''
         now = str(datetime.now())
-        sheet = self.db.get_worksheet(2)
-        sheet.append_row([str(member.id), member.name, now])
+        sheet = await self.cache.worksheet(2)
+        row = [str(member.id), member.name, now]
+        if await self.writes.append_row(sheet, row) is None and self.cache.mirror is not None:
+            # Nothing downloads the leavers sheet, its mirror only gets the rows written here (queued ones are in already)
+            await run_local(self.cache.mirror.append, 2, [row])
+        self.cache.invalidate(2)
         print(f'{member.name} left the server at {now}')
 
 
-    def query(self, msg):
-        '''Query and Filter entries in Content Sheet'''
+    def refresh(self):
+        '''Drop the cached worksheet snapshots'''
+        self.cache.invalidate()
+        return "Cleared the cached sheets, the next command will fetch fresh data"
 
-        # Parse the input text into a list of dicts
-        args = parse_args(msg)
-
-        # Get the worksheet
-        sheet = self.db.get_worksheet(0)
-        data = sheet.get_all_values()[1:]
+    async def content(self):
+        '''Returns the indexed table of the latest content sheet snapshot'''
+        data = await self.cache.get(0)
+        if self.table.source is not data:
+            self.table = ContentTable(data)
+        return self.table
 
-        # Create a dataframe
-        df = pd.DataFrame(np.array(data), columns=['name', 'title', 'status', 'category'])
+    async def query(self, msg):
+        '''Query and Filter entries in Content Sheet, returns a Paginator of the results or an error string'''
 
         try:
-            for arg in args:
+            filters = list(self.query_args.parse(msg).items())
+        except ArgsError as e:
+            return str(e)
 
-                if arg['col'].strip() == 'category':
-                    val = self.cat_map[arg['val']]
-                else:
-                    val = arg['val'].strip().title()
-
-                df = df[df[arg['col'].strip().lower()] == val]
-        except:
-            return "That command doesn't seem right?!"
+        # Get the indexed worksheet
+        content = await self.content()
+        rows = content.select(filters)
 
-        if len(df) < 1:
+        if len(rows) < 1:
             return "No data found for the requested query"
 
-        # Create a formatted response string
-        table = PrettyTable(['Name', 'Title', 'Status', 'Category'])
+        # Pages of the formatted results, rendered as they are viewed
+        table = TableFormatter(['Name', 'Title', 'Status', 'Category'], [row.values() for row in rows])
+        title = f'**Content Sheet Query Results** ({len(rows)} rows)\nFor Query Command `{msg[:100]}`'
+
+        return Paginator(title, table)
+
 
-        for row in df.values.tolist():
-            table.add_row(row)
+    async def search(self, msg):
+        '''Full-text search of the titles, names and categories in the Content Sheet'''
+        data = await self.cache.get(0)
+        self.search_index.sync(data)
 
-        response_string = f'**Content Sheet Query Results**\nFor Query Command `{msg}`\n```\n{table}\n```'
+        results = self.search_index.search(msg, k=10)
+        if len(results) < 1:
+            return "No data found for the search"
+
+        # Create a formatted response string, with long titles cut to fit in a message
+        rows = [(data[num] + [''] * 4)[:4] + [f'{score:.1f}'] for num, score in results]
+        table = TableFormatter(['Name', 'Title', 'Status', 'Category', 'Score'], rows).render(0, len(rows))
+
+        response_string = f'**Content Sheet Search Results**\nFor Search `{msg[:100]}`\n```\n{table}\n```'
 
         return response_string
 
+    def parse_add(self, msg):
+        '''Returns the row to add for an add command, or an error string'''
+        try:
+            add_info = self.add_args.parse(msg)
+        except ArgsError as e:
+            return str(e)
 
-    def add(self, msg):
-        '''Add a new row in the content sheet'''
+        if 'status' not in add_info:
+            add_info['status'] = 'Proposed'
 
-        # Parse the input text into a list of dicts
-        args = parse_args(msg)
+        return [add_info.get(col, '') for col in ContentTable.columns]
 
-        # Convert the args list into a dictionary
+    def parse_update(self, msg):
+        '''Returns the title and new status of an update command, or an error string'''
         try:
-            add_info = {}
-            for arg in args:
-                col = arg['col'].strip().lower()
-                val = arg['val'].strip()
-
-                if col == 'category':
-                    add_info[col] = self.cat_map[val.lower()]
-                elif arg['col'].strip() == 'title':
-                    add_info[col] = val
-                else:
-                    add_info[col] = val.title()
+            args = self.update_args.parse(msg)
+        except ArgsError as e:
+            return str(e)
+
+        return args['title'], args['status']
+
+    def match_title(self, title):
+        '''Returns the (row index, score) of the titles similar to the given one, best first, and whether they are
+        too close to pick one. The title index must be synced with the snapshot first'''
+        matches = [m for m in self.titles.top(title, k=5) if m[1] > 0.2]
+
+        # Don't guess between titles that match about equally well
+        ambiguous = len(matches) > 1 and matches[0][1] < 0.99 and matches[1][1] > matches[0][1] - 0.1
+
+        return matches, ambiguous
 
-            if len(add_info) < 2:
-                return "Please provide data for atleast 2 columns (eg: name, title)"
+    async def unchanged(self, sheet, data, rows):
+        '''Whether the rows (indices into the snapshot data) still hold the same titles in the content sheet,
+        read with one batched call for just their title cells'''
+        if not rows:
+            return True
+
+        try:
+            cells = await self.cache.runner.request(sheet.batch_get, [f'B{idx + 2}' for idx in rows])
         except Exception as e:
-            print(e)
-            return "That command doesn't seem right?!"
+            if not unreachable(e):
+                raise
+            # Can't tell, and the write will most likely be queued in the mirror the snapshot came from
+            return True
 
-        if 'status' not in add_info:
-            add_info['status'] = 'Proposed'
+        return all((values[0][0] if values and values[0] else '') == (data[idx] + ['', ''])[1]
+                   for idx, values in zip(rows, cells))
 
-        df = pd.DataFrame(columns=['name', 'title', 'status', 'category'])
-        row = df.append(add_info, ignore_index=True).fillna('').values.tolist()[0]
+    async def add(self, msg):
+        '''Add a new row in the content sheet'''
+        row = self.parse_add(msg)
+        if isinstance(row, str):
+            return row
 
         # Create a formatted response string
         table = PrettyTable(['Name', 'Title', 'Status', 'Category'])
@@ -128,112 +177,208 @@ class Status():
         response_string = f'**Added a New Entry to the Content Sheet**\n```\n{table}\n```'
 
         # Add the row to worksheet
-        sheet = self.db.get_worksheet(0)
-        sheet.append_row(row)
+        sheet = await self.cache.worksheet(0)
+        if await self.writes.append_row(sheet, row) == 'queued':
+            response_string += QUEUED_NOTE
+        self.cache.invalidate(0)
 
         return response_string
 
-    def update(self, msg):
+    async def update(self, msg):
         '''Update the status of a titled piece'''
-
-        # Parse the input text into a list of dicts
-        args = parse_args(msg)
-
-        try:
-            args_map = {}
-            for arg in args:
-                if arg['col'] == 'title':
-                    args_map['title'] = arg['val'].strip()
-                elif arg['col'] == 'status':
-                    args_map['status'] = arg['val'].strip()
-
-            if len(args_map) < 2:
-                return "That command doesn't seem right?!"
-        except:
-            return "That command doesn't seem right?!"
+        args = self.parse_update(msg)
+        if isinstance(args, str):
+            return args
+        title, new_status = args
 
         # Get the worksheet
-        sheet = self.db.get_worksheet(0)
-        data = sheet.get_all_values()[1:]
-        titles = np.array(data)[:, 1]
-
-        # Get the row number of the user provided title
-        similarities = np.array([check_similar(title, args_map['title']) for title in titles])
-        if max(similarities) > 0.2:
-            row_num = similarities.argmax() + 2
+        sheet = await self.cache.worksheet(0)
+        await load_numeric()
+
+        # Matched against the snapshot, then checked in the sheet in case rows moved since it was taken
+        for attempt in range(2):
+            data = await self.cache.get(0)
+            self.titles.sync([row[1] for row in data])
+
+            # Get the row number of the user provided title
+            matches, ambiguous = self.match_title(title)
+            if len(matches) < 1:
+                return "Can't find any row with that title to update the status"
+
+            if ambiguous:
+                table = PrettyTable(['Title', 'Score'])
+                for idx, score in matches:
+                    table.add_row([data[idx][1], f'{score:.2f}'])
+                return f"**Multiple titles match, please be more specific**\n```\n{table}\n```"
+
+            idx = matches[0][0]
+            if await self.unchanged(sheet, data, [idx]):
+                break
+            self.cache.invalidate(0)
         else:
-            return "Can't find any row with that title to update the status"
+            return "The content sheet is being rearranged right now, try again in a bit"
 
-        sheet.update_cell(row_num, 3, args_map['status'].title())
+        result = await self.writes.update_cell(sheet, idx + 2, 3, new_status)
+        self.cache.invalidate(0)
+
+        # The updated row, without reading it back from the sheet
+        row = (data[idx] + [''] * 4)[:4]
+        row[2] = new_status
 
         # Create a formatted response string
         table = PrettyTable(['Name', 'Title', 'Status', 'Category'])
-        table.add_row(sheet.row_values(row_num))
+        table.add_row(row)
         response_string = f"**Status Updated**\n```\n{table}\n```"
+        if result == 'queued':
+            response_string += QUEUED_NOTE
 
         return response_string
 
+    async def bulk_add(self, entries):
+        '''Add a row for every add command in entries, with one append to the sheet.
+        Returns a Paginator of the outcome of every entry'''
+        results, rows = [], []
+        for entry in entries:
+            row = self.parse_add(entry)
+            if isinstance(row, str):
+                results.append(['', entry, '', '', 'Not understood'])
+            else:
+                results.append(row + ['Added'])
+                rows.append(row)
+
+        # Queued together so they go out as a single append_rows
+        sheet = await self.cache.worksheet(0)
+        outcome = await asyncio.gather(*[self.writes.append_row(sheet, row) for row in rows])
+        if rows:
+            self.cache.invalidate(0)
+
+        title = f'**Added {len(rows)} of {len(entries)} entries to the Content Sheet**'
+        if 'queued' in outcome:
+            title += QUEUED_NOTE
+
+        return Paginator(title, TableFormatter(['Name', 'Title', 'Status', 'Category', 'Result'], results))
+
+    async def bulk_update(self, entries):
+        '''Update the status of every piece in entries, matched against one snapshot and written with one batch update.
+        Returns a Paginator of the outcome of every entry, or an error string'''
+        sheet = await self.cache.worksheet(0)
+        await load_numeric()
+
+        # Matched against the snapshot, then checked in the sheet in case rows moved since it was taken
+        for attempt in range(2):
+            data = await self.cache.get(0)
+            self.titles.sync([row[1] for row in data])
+
+            results, updates = [], {} # row index -> (entry number, new status)
+            for num, entry in enumerate(entries):
+                args = self.parse_update(entry)
+                if isinstance(args, str):
+                    results.append(['', entry, '', '', 'Not understood'])
+                    continue
+
+                title, new_status = args
+                matches, ambiguous = self.match_title(title)
+                if len(matches) < 1:
+                    results.append(['', title, new_status, '', 'No matching title'])
+                elif ambiguous:
+                    results.append(['', title, new_status, '', f'{len(matches)} titles match'])
+                elif matches[0][0] in updates:
+                    results.append(['', title, new_status, '', f'Same row as entry {updates[matches[0][0]][0] + 1}'])
+                else:
+                    idx = matches[0][0]
+                    updates[idx] = (num, new_status)
 
-class Scheduler():
-
-    def __init__(self):
-        # Category shorthands
-        self.cat_map = {'fringe': 'Fringe Bureau',
-                        'psyche': 'Psyche',
-                        'stem': 'STEM Lab',
-                        'mint': 'Mint Affairs',
-                        'footprints': 'Footprints',
-                        'inspire': 'Inspire',
-                        'yolo': 'YOLO'}
-
-    def get_schedule(self, msg):
-        '''Returns the timestamps of the stories and post for a particular post'''
-        args = parse_args(msg)
-
-        # Convert the args list into a dictionary
-        try:
-            add_info = {}
-            timestamps = []
+                    # The updated row, without reading it back from the sheet
+                    row = (data[idx] + [''] * 4)[:4]
+                    row[2] = new_status
+                    results.append(row + ['Updated'])
 
-            for arg in args:
-                col = arg['col'].strip().lower()
-                val = arg['val'].strip()
+            if await self.unchanged(sheet, data, list(updates)):
+                break
+            self.cache.invalidate(0)
+        else:
+            return "The content sheet is being rearranged right now, try again in a bit"
 
-                if col not in ['title', 'category', 'date']:
-                    continue # verify the col is valid
+        # Queued together so they go out as a single batch_update
+        outcome = await asyncio.gather(*[self.writes.update_cell(sheet, idx + 2, 3, new_status)
+                                         for idx, (_, new_status) in updates.items()])
+        if updates:
+            self.cache.invalidate(0)
 
-                if col == 'category':
-                    add_info[col] = self.cat_map[val]
+        title = f'**Updated {len(updates)} of {len(entries)} statuses**'
+        if 'queued' in outcome:
+            title += QUEUED_NOTE
 
-                # Create timestamps and date strings
-                elif col == 'date':
-                    date_str = f"{val} 11:00"
+        return Paginator(title, TableFormatter(['Name', 'Title', 'Status', 'Category', 'Result'], results))
 
-                    post_date = datetime.strptime(date_str, "%d-%m-%Y %H:%M")
-                    s1_date = post_date - timedelta(days=1, hours=-7)
-                    s2_date = post_date + timedelta(hours=3)
 
-                    timestamps.extend([s1_date, post_date, s2_date])
+class Scheduler():
 
-                    s1_str = "{}-{}-{} 18:00".format(s1_date.day, s1_date.month, s1_date.year)
-                    s2_str = "{}-{}-{} 14:00".format(s2_date.day, s2_date.month, s2_date.year)
+    def __init__(self, reminders_file='reminders.db', config=None):
+        # Settings of the server, Rubrix if not given
+        self.config = config or GuildConfig({}, primary=True)
+        self.job = f'scheduler {self.config.id}' # name of its supervised task
+
+        # Category shorthands and spellings
+        self.categories = self.config.categories
+
+        # Arguments of the commands, compiled once
+        self.schedule_args = Schema(Choice('category', self.categories), Text('title', case=None), Date('date'),
+                                    required=['category', 'title', 'date'],
+                                    usage='--schedule category=stem, title=..., date=dd-mm-yyyy')
+        self.remind_args = Schema(Date('time', time=True), Text('msg', case=None), required=['time', 'msg'],
+                                  usage='--remind time=dd-mm-yyyy hh:mm, msg=...')
+
+        # Pending reminders of the server, loaded once and saved only when they change
+        self.store = ReminderStore(reminders_file, guild=self.config.id)
+        if self.config.primary:
+            self.store.claim()
+            self.store.migrate(os.path.splitext(reminders_file)[0] + '.pkl')
+
+        self.queue = ReminderQueue()
+        for rid, ts, meta in self.store.pending():
+            self.queue.push(ts, (rid, meta))
+        print(f'Loaded {len(self.queue)} reminders')
+        metrics.set('scheduler_queue_depth', len(self.queue), guild=self.config.name)
+
+    # When the stories go out relative to the post
+    slots = [('Story 1', timedelta(days=-1, hours=7)), ('Post', timedelta(0)), ('Story 2', timedelta(hours=3))]
+    # How long before the post or story each reminder goes out
+    leads = [('Post', timedelta(hours=48)), ('Post', timedelta(hours=24)), ('Post', timedelta(minutes=30)),
+             ('Story 1', timedelta(hours=3)), ('Story 1', timedelta(minutes=30)),
+             ('Story 2', timedelta(hours=3)), ('Story 2', timedelta(minutes=30))]
+
+    async def push(self, entries):
+        '''Save (timestamp, meta) reminders and queue them'''
+        ids = await run_local(self.store.add, entries)
+        for rid, (ts, meta) in zip(ids, entries):
+            self.queue.push(ts, (rid, meta))
+
+        metrics.set('scheduler_queue_depth', len(self.queue), guild=self.config.name)
+
+    async def add_reminders(self, reminders):
+        '''Save the (timestamps, map) reminders of a post and queue them'''
+        reminders_ts, reminders_map = reminders
+        await self.push([(ts, reminders_map[ts]) for ts in reminders_ts])
 
-                    add_info['story 1'] = s1_str
-                    add_info['post'] = date_str
-                    add_info['story 2'] = s2_str
+    def get_schedule(self, msg):
+        '''Returns the timestamps of the stories and post for a particular post'''
+        try:
+            args = self.schedule_args.parse(msg)
+        except ArgsError as e:
+            return str(e), -1, -1
 
-                else: # for title
-                    add_info[col] = val
+        # Create timestamps and date strings
+        post_date = args['date'].replace(hour=11)
+        s1_date = post_date - timedelta(days=1, hours=-7)
+        s2_date = post_date + timedelta(hours=3)
 
-            if len(add_info) < 3:
-                return "Please provide data for all 3 columns (eg: category, title, date)", -1, -1
+        timestamps = [s1_date, post_date, s2_date]
 
-        except Exception as e:
-            print(e)
-            return "That command doesn't seem right?!", -1, -1
+        s1_str = "{}-{}-{} 18:00".format(s1_date.day, s1_date.month, s1_date.year)
+        s2_str = "{}-{}-{} 14:00".format(s2_date.day, s2_date.month, s2_date.year)
 
-        df = pd.DataFrame(columns=['category', 'title', 'story 1', 'post', 'story 2'])
-        values = df.append(add_info, ignore_index=True).fillna('').values.tolist()[0]
+        values = [args['category'], args['title'], s1_str, f'{post_date:%d-%m-%Y %H:%M}', s2_str]
 
         # Create a formatted response string
         response_string = f'**Added to schedule and reminders are set**\n```\n> Category = {values[0]}\
@@ -252,183 +397,332 @@ class Scheduler():
         '''Returns the timestamps of the reminders'''
 
         # Get the Scheduled timestamps
-        s1_t, post_t, s2_t = timestamps
-
-        # Create reminder timestamps
-        post_r1 = post_t - timedelta(hours=48)
-        post_r2 = post_t - timedelta(hours=24)
-        post_r3 = post_t - timedelta(minutes=30)
-
-        s1_r1 = s1_t - timedelta(hours=3)
-        s1_r2 = s1_t - timedelta(minutes=30)
-
-        s2_r1 = s2_t - timedelta(hours=3)
-        s2_r2 = s2_t - timedelta(minutes=30)
+        published = dict(zip(['Story 1', 'Post', 'Story 2'], timestamps))
 
         # Reminders
-        reminders_ts = [post_r1, post_r2, post_r3, s1_r1, s1_r2, s2_r1, s2_r2]
+        reminders_ts = [published[kind] - lead for kind, lead in self.leads]
 
-        meta_data = [['Post', post_t], ['Post', post_t], ['Post', post_t],
-                     ['Story 1', s1_t], ['Story 1', s1_t], ['Story 2', s2_t], ['Story 2', s2_t]]
-
-        reminders_map = {t: post_details + m for t, m in zip(reminders_ts, meta_data)}
+        reminders_map = {t: post_details + [kind, published[kind]] for t, (kind, _) in zip(reminders_ts, self.leads)}
 
 
         return reminders_ts, reminders_map
 
 
+    def bulk_schedule(self, records, now=None):
+        '''Schedules a content calendar, records are its {category, title, date} rows from a CSV or worksheet.
+        Returns a Paginator of the posts with their (timestamp, meta) reminders, or an error string and no reminders'''
+        import numpy as np
+
+        now = now or datetime.now()
+        errors = []
+        lines, posts, dmy, parsed = [], [], [], []
+        seen = {}
+
+        for line, record in enumerate(records, start=2): # line 1 is the header
+            record = {str(k).strip().lower(): (v or '').strip() for k, v in record.items() if k}
+            if not any(record.values()):
+                continue # blank line
+
+            category = self.categories.get(record.get('category', ''))
+            title = record.get('title', '')
+            date = DATE.fullmatch(record.get('date', ''))
+
+            if category is None:
+                errors.append((line, f"unknown category '{record.get('category', '')}'"))
+            if not title:
+                errors.append((line, 'missing title'))
+            elif title.lower() in seen:
+                errors.append((line, f'same title as line {seen[title.lower()]}'))
+            if not date:
+                errors.append((line, f"date '{record.get('date', '')}' isn't dd-mm-yyyy"))
+
+            seen.setdefault(title.lower(), line)
+            lines.append(line)
+            posts.append([category, title])
+            dmy.append([int(x) for x in date.groups()] if date else [1, 1, 1970]) # placeholder, already reported
+            parsed.append(bool(date))
+
+        if not posts and not errors:
+            return "There's nothing to schedule, the calendar needs category, title and date columns", []
+
+        # All the dates at once, as days since the epoch
+        dmy = np.array(dmy, dtype=np.int64).reshape(-1, 3)
+        parsed = np.array(parsed, dtype=bool)
+        month = ((dmy[:, 2] - 1970) * 12 + dmy[:, 1] - 1).astype('datetime64[M]')
+        days = month.astype('datetime64[D]') + (dmy[:, 0] - 1)
+        invalid = (dmy[:, 1] < 1) | (dmy[:, 1] > 12) | (dmy[:, 0] < 1) | (days.astype('datetime64[M]') != month)
+
+        # Story 1, Post and Story 2 of every post, then every reminder of them
+        post = days.astype('datetime64[m]') + np.timedelta64(11 * 60, 'm')
+        slots = np.array([offset // timedelta(minutes=1) for _, offset in self.slots], dtype='timedelta64[m]')
+        published = post[:, None] + slots
+
+        kinds = [kind for kind, _ in self.slots]
+        leads = np.array([lead // timedelta(minutes=1) for _, lead in self.leads], dtype='timedelta64[m]')
+        of = [kinds.index(kind) for kind, _ in self.leads] # the slot each reminder is for
+        reminders = published[:, of] - leads
+
+        past = post <= np.datetime64(now, 'm')
+        for i in np.flatnonzero(parsed & (invalid | past)):
+            if invalid[i]:
+                errors.append((lines[i], f'{"-".join(map(str, dmy[i]))} is not a real date'))
+            else:
+                errors.append((lines[i], f'{days[i].astype(datetime):%d-%m-%Y} is already in the past'))
+
+        if errors:
+            errors.sort(key=lambda e: e[0])
+            shown = '\n'.join(f'Line {line}: {error}' for line, error in errors[:15])
+            if len(errors) > 15:
+                shown += f'\n... and {len(errors) - 15} more'
+            return f"**Nothing was scheduled, fix these and try again**\n```\n{shown}\n```", []
+
+        # Back to datetimes, dropping the reminders that are already due
+        published = published.astype(datetime)
+        upcoming = reminders > np.datetime64(now, 'm')
+        reminders = reminders.astype(datetime)
+
+        entries = []
+        for i, j in zip(*np.nonzero(upcoming)):
+            entries.append((reminders[i, j], posts[i] + [kinds[of[j]], published[i, of[j]]]))
+
+        rows = [posts[i] + [f'{ts:%d-%m-%Y %H:%M}' for ts in published[i]] for i in range(len(posts))]
+        title = f'**Added {len(posts)} posts to the schedule and set {len(entries)} reminders**'
+        return Paginator(title, TableFormatter(['Category', 'Title'] + kinds, rows)), entries
+
+
     async def run_scheduler(self, bot):
         '''Starts the reminder timeout'''
-        print('Running Scheduler...')
+        print(f'Running Scheduler for {self.config.name}...')
 
         # Roles and channels for mentioning
-        writer = "<@&747703681985544202>"
-        designer = "<@&747703676587737229>"
-        channel = bot.get_channel(755142334496243892) # publishing channel <#755142334496243892>
+        writer = self.config.mention('writer')
+        designer = self.config.mention('designer')
+        channel = bot.get_channel(self.config.channels['publishing'])
 
         while(1):
-            # Pre-Sleep
-            await asyncio.sleep(60)
+            # Sleep until the next batch of reminders is due
+            due = await self.queue.wait()
+            started = monotonic()
+            now = datetime.now()
 
-            # Load reminders
             try:
-                reminders_ts, reminders_map = load_reminders()
-                print('\nLoading Reminders...')
-            except:
-                reminders_ts, reminders_map = [], {}
-                print('\nNo reminders')
+                for ts, (rid, meta) in due:
+
+                    # Ad-hoc reminder from --remind, sent even if late
+                    if isinstance(meta, dict):
+                        print(f'\nReminding Now at {ts}')
+                        remind_channel = bot.get_channel(meta['channel'])
+                        if remind_channel is not None:
+                            try:
+                                await remind_channel.send(f"**Reminder:** {meta['msg']}")
+                            except discord.HTTPException as e:
+                                print(f'[SCHEDULER] Could not send reminder {rid}: {e!r}')
+                                metrics.inc('scheduler_send_errors_total')
+
+                    # Post reminder, meta is category, title, type, timestamp
+                    elif now - ts <= self.queue.grace:
+                        print(f'\nReminding Now at {ts}')
+
+                        response_string = f"**Reminder for {meta[2]}**\n```\n> Title        = {meta[1]}\
+                                                                       \n> Category     = {meta[0]}\
+                                                                       \n> Publish On   = {meta[3]}\
+                                                                       \n``` {writer} {designer}"
+
+                        print(response_string)
+                        try:
+                            await channel.send(response_string)
+                        except discord.HTTPException as e:
+                            print(f'[SCHEDULER] Could not send reminder {rid}: {e!r}')
+                            metrics.inc('scheduler_send_errors_total')
+
+                    # If it was missed (eg: the bot was down)
+                    else:
+                        print(f"**Skipping the Reminder**\n```\n> Content-Type = {meta[2]}\
+                                                          \n> Title        = {meta[1]}\
+                                                          \n> Category     = {meta[0]}\
+                                                          \n> Publish On   = {meta[3]}\
+                                                          \n> Reminder     = {ts}\
+                                                          \n```")
+            finally:
+                # Completed even if sending broke off, or the same batch would crash the job after every restart
+                await run_local(self.store.complete, [rid for _, (rid, _) in due])
+
+            metrics.set('scheduler_queue_depth', len(self.queue), guild=self.config.name)
+            metrics.inc('scheduler_reminders_total', len(due))
+            supervisor.ran(self.job, monotonic() - started)
 
-            if len(reminders_ts) == 0:
-                continue
 
-            # Sort reminders
-            reminders_ts.sort()
+    def remind(self, msg):
+        '''Returns the reminder time with the parsed reminder message'''
+        try:
+            args = self.remind_args.parse(msg)
+        except ArgsError as e:
+            return -1, str(e)
 
-            print('[TS]', reminders_ts)
-#             print('\n[MAP]',reminders_map)
+        t_remind = args['time']
+        print('t_remind:', t_remind)
 
-            # Current timestamp
-            now = datetime.now().replace(second=0, microsecond=0)
+        if t_remind <= datetime.now():
+            return -1, "That time is already in the past!"
 
-            # Post meta data
-            meta = reminders_map[reminders_ts[0]] # category, title, type, timestamp
+        return t_remind, {'time': f'{t_remind:%d-%m-%Y %H:%M}', 'msg': args['msg']}
 
-            # Check if current time is equal to reminder time
-            if now == reminders_ts[0]:
-                print(f'\nReminding Now at {reminders_ts[0]}')
 
-                response_string = f"**Reminder for {meta[2]}**\n```\n> Title        = {meta[1]}\
-                                                                   \n> Category     = {meta[0]}\
-                                                                   \n> Publish On   = {meta[3]}\
-                                                                   \n``` {writer} {designer}"
+class NewsBot():
 
-                print(response_string)
-                await channel.send(response_string)
+    def __init__(self, db, mirror=None, config=None, writes=writes):
+        # Settings of the server, Rubrix if not given
+        self.config = config or GuildConfig({}, primary=True)
+        self.job = f'newsbot {self.config.id}' # name of its supervised task
 
-                remove_save(reminders_ts, reminders_map)
+        # Content-DB spreadsheet of the server, its local copy and the queue that batches the writes to it
+        self.db = db
+        self.mirror = mirror
+        self.writes = writes
+        self.sheet = self.db.get_worksheet(1)
 
-            # If its in the past
-            elif now > reminders_ts[0]:
-                print(f"**Skipping the Reminder**\n```\n> Content-Type = {meta[2]}\
-                                                      \n> Title        = {meta[1]}\
-                                                      \n> Category     = {meta[0]}\
-                                                      \n> Publish On   = {meta[3]}\
-                                                      \n> Reminder     = {reminders_ts[0]}\
-                                                      \n```")
-                remove_save(reminders_ts, reminders_map)
+        self.channel_ids = self.config.channels
+        self.guild_id = self.config.id
 
+        self.timings = [datetime.strptime(t, "%H:%M").time() for t in self.config.newsbot_timings]
+        # self.timings = [datetime.strptime("10:30", "%H:%M").time(),
+        #                 datetime.strptime("14:00", "%H:%M").time(),
+        #                 datetime.strptime("18:00", "%H:%M").time(),
+        #                 datetime.strptime("19:30", "%H:%M").time()]
 
-    def remind(self, msg):
-        '''Returns the sleep time in seconds with the parsed reminder message'''
-        args = parse_args(msg)
+        # Local queue of the unposted links, refreshed this long before each slot
+        self.lead = timedelta(minutes=5)
+        self.links = deque() # (row number, link, caption)
+        self.modified = None # last update time of the spreadsheet when the links were downloaded
 
-        try:
-            args_map = {}
-            for arg in args:
-                if arg['col'] == 'time':
-                    args_map['time'] = arg['val'].strip()
-                elif arg['col'] == 'msg':
-                    args_map['msg'] = arg['val'].strip()
-
-            if len(args_map) < 2:
-                return -1, "That command doesn't seem right!"
-
-            t_remind = datetime.strptime(args_map['time'], "%d-%m-%Y %H:%M")
-            print('t_remind:', t_remind)
-            now = datetime.now()
-            print('now:', now)
-            t_delta = (t_remind - now).seconds + 5
-
-            return t_delta, args_map
+    def next_slot(self, now):
+        '''Returns the datetime of the next posting slot after now'''
+        slots = [datetime.combine(now.date() + timedelta(days=day), t) for day in (0, 1) for t in self.timings]
+        return min(slot for slot in slots if slot > now)
 
-        except Exception as E:
-            print(E)
-            return -1, "That command doesn't seem right! Check if the date-time format is correct"
+    def last_update(self):
+        '''Last modification time of the spreadsheet, None if gspread can't tell'''
+        getter = getattr(self.db, 'get_lastUpdateTime', None)
+        return getter() if getter is not None else None
 
+    async def refresh(self):
+        '''Reload the queue of unposted links, unless the spreadsheet is unchanged since the last download'''
+        try:
+            modified = await blocking.request(self.last_update, key=('last_update', self.db.id))
+        except Exception as e:
+            print(f'[NEWSBOT] Could not get the last update time: {e}')
+            modified = None
 
-class NewsBot():
+        if modified is not None and modified == self.modified:
+            print('[NEWSBOT] Links sheet unchanged')
+            return
 
-    def __init__(self):
-        self.scope = ["https://spreadsheets.google.com/feeds",
-                      "https://www.googleapis.com/auth/spreadsheets",
-                      "https://www.googleapis.com/auth/drive.file",
-                      "https://www.googleapis.com/auth/drive"]
-        self.creds = ServiceAccountCredentials.from_json_keyfile_name("creds.json", self.scope)
-        self.gclient = gspread.authorize(self.creds)
+        try:
+            data = (await blocking.request(self.sheet.get_all_values, key=('values', self.db.id, self.sheet.id)))[1:]
+        except Exception as e:
+            if self.mirror is None or not unreachable(e) or len(self.links) > 0:
+                raise
+            print('[NEWSBOT] Sheets unreachable, loading the links from the mirror')
+            self.links = deque((idx + 2, row[0], row[1]) for idx, row in enumerate(await run_local(self.mirror.rows, 1)) if row[2] == "")
+            return
 
-        # Load Spreadsheet
-        self.db = self.gclient.open("Content-DB")
-        self.sheet = self.db.get_worksheet(1)
+        if self.mirror is not None:
+            await run_local(self.mirror.sync, 1, data)
 
-        self.channel_ids = {'bot-testing-zone': 755079000962891891, 'discussions': 754337556023345223}
-        self.rubrix_id = 737282578117034004
+        self.links = deque((idx + 2, row[0], row[1]) for idx, row in enumerate(data) if row[2] == "")
+        self.modified = modified
 
+        metrics.set('newsbot_queue_depth', len(self.links), guild=self.config.name)
+        print(f'[NEWSBOT] {len(self.links)} links in the buffer')
 
     async def run(self, bot):
         '''Sends a news article link with an optional caption and mentions a user every 24 hours'''
-        print('Running NewsBot...')
-
-        timings = [datetime.strptime("18:00", "%H:%M").time()]
-        # timings = [datetime.strptime("10:30", "%H:%M").time(),
-        #            datetime.strptime("14:00", "%H:%M").time(),
-        #            datetime.strptime("18:00", "%H:%M").time(),
-        #            datetime.strptime("19:30", "%H:%M").time()]
+        print(f'Running NewsBot for {self.config.name}...')
 
         while(1):
-            # Pre-Sleep
-            await asyncio.sleep(60)
+            slot = self.next_slot(datetime.now())
 
-            # Get the data
-            data = self.sheet.get_all_values()[1:]
-            df = pd.DataFrame(np.array(data), columns=['link', 'caption', 'isDone'])
-            buffer = df[df['isDone'] == ""].T.to_dict()
+            # Refresh the links shortly before the slot
+            await sleep_until(slot - self.lead)
+            with metrics.timer('newsbot_refresh_seconds'):
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    if not unreachable(e):
+                        raise
+                    print(f'[NEWSBOT] Could not fetch the links sheet ({e!r}), using the old buffer')
 
-            if len(buffer) < 1:
+            await sleep_until(slot)
+
+            if len(self.links) < 1:
                 print('[NEWSBOT] Links Buffer is Empty!')
                 continue
 
-            # Current time
-            now = datetime.now().replace(second=0, microsecond=0).time()
+            with metrics.timer('newsbot_post_seconds'), supervisor.timed(self.job):
+                print('[NEWSBOT] Sharing the article link...')
 
-            if now not in timings:
-                print('[NEWSBOT] Ping')
-                continue
+                # Get the first article from the buffer
+                row_num, link, caption = self.links.popleft()
+                metrics.set('newsbot_queue_depth', len(self.links), guild=self.config.name)
+
+                # Select 2 random members
+                members = [member for member in bot.get_guild(self.guild_id).members if not member.bot]
+                select = random.sample(members, k=2)
+
+                # Format message
+                message = f"{link} \n{caption if caption != '' else f'What are your thoughts?'} <@!{select[0].id}> <@!{select[1].id}>"
+
+                # Send message
+                channel = bot.get_channel(self.channel_ids['discussions'])
+                await channel.send(message)
+
+                # Update status to done (1)
+                await self.writes.update_cell(self.sheet, row_num, 3, '1')
+
+
+class Minecraft():
+    '''Start, stop and check the Rubrix MC SMP server through its Lambda endpoint'''
+
+    def __init__(self, url=None, timeout=30, status_ttl=30):
+        self.url = url or os.environ.get('MC_URL', 'https://at9x4tzxhe.execute-api.us-east-1.amazonaws.com/')
+        self.timeout = timeout # seconds, the Lambda can take a while to cold start
+        self.status_ttl = status_ttl # seconds a status result is reused
+
+        self.session = None # created on first use, inside the event loop
+        self.inflight = {} # command -> task of the request in progress
+        self.status = None # (fetched at, status)
+
+    async def get_session(self):
+        if self.session is None or self.session.closed:
+            import aiohttp
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                 connector=aiohttp.TCPConnector(limit=4))
+        return self.session
+
+    async def command(self, cmd):
+        '''Send start, stop or status and return the server status'''
+        if cmd == 'status' and self.status is not None and monotonic() - self.status[0] < self.status_ttl:
+            return self.status[1]
 
-            print('[NEWSBOT] Sharing the article link...')
+        # Members sending the same command at once share one request
+        if cmd not in self.inflight:
+            task = asyncio.ensure_future(self._post(cmd))
+            self.inflight[cmd] = task
+            task.add_done_callback(lambda _: self.inflight.pop(cmd, None))
 
-            # Get the first article from the buffer
-            idx, info = list(buffer.items())[0]
+        result = await asyncio.shield(self.inflight[cmd])
 
-            # Select 2 random members
-            members = [member for member in bot.get_guild(self.rubrix_id).members if not member.bot]
-            select = random.sample(members, k=2)
+        # start and stop change the status
+        self.status = (monotonic(), result) if cmd == 'status' else None
 
-            # Format message
-            message = f"{info['link']} \n{info['caption'] if info['caption'] != '' else f'What are your thoughts?'} <@!{select[0].id}> <@!{select[1].id}>"
+        return result
 
-            # Send message
-            channel = bot.get_channel(self.channel_ids['discussions'])
-            await channel.send(message)
+    async def _post(self, cmd):
+        session = await self.get_session()
+        async with session.post(self.url, json=cmd) as resp:
+            resp.raise_for_status()
+            return await resp.json(content_type=None)
 
-            # Update status to done (1)
-            self.sheet.update_cell(idx+2, 3, '1')
\ No newline at end of file
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
@@ -0,0 +1,138 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+
+class ReminderQueue():
+    '''In-memory priority queue of reminders that sleeps until the next one is due'''
+
+    def __init__(self, grace=timedelta(minutes=5), max_sleep=3600):
+        self.heap = [] # (due, seq, item)
+        self.counter = itertools.count() # tie breaker so items are never compared
+        self.wakeup = asyncio.Event()
+
+        self.grace = grace # reminders later than this are skipped instead of sent
+        self.max_sleep = max_sleep # re-check the clock at least this often, in case it jumps
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, due, item):
+        '''Insert a reminder, waking up the waiter if it is now the earliest one'''
+        seq = next(self.counter)
+        heapq.heappush(self.heap, (due, seq, item))
+
+        if self.heap[0][1] == seq:
+            self.wakeup.set()
+
+    def pop_due(self, now):
+        '''Remove and return all the (due, item) reminders due at or before now'''
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            ts, _, item = heapq.heappop(self.heap)
+            due.append((ts, item))
+        return due
+
+    async def wait(self):
+        '''Sleep until reminders are due and return them as a batch'''
+        while True:
+            self.wakeup.clear()
+
+            if self.heap:
+                delay = (self.heap[0][0] - datetime.now()).total_seconds()
+                if delay <= 0:
+                    return self.pop_due(datetime.now())
+                delay = min(delay, self.max_sleep)
+            else:
+                delay = self.max_sleep
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+class ReminderStore():
+    '''Durable reminder storage backed by SQLite, indexed by due time, holding the reminders of one server'''
+
+    def __init__(self, filename='reminders.db', guild=None):
+        self.guild = guild # reminders of other servers in the same file are left alone
+
+        # The scheduler goes through the single local thread of sheets.run_local, but the startup and the
+        # benchmark call it directly, so the connection may be used from several threads and the lock orders them
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = threading.Lock()
+
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS reminders (
+                                     id INTEGER PRIMARY KEY,
+                                     due TEXT NOT NULL,
+                                     meta TEXT NOT NULL,
+                                     guild INTEGER)''')
+
+            # Files from before there were several servers
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(reminders)')]
+            if 'guild' not in columns:
+                self.conn.execute('ALTER TABLE reminders ADD COLUMN guild INTEGER')
+
+            self.conn.execute('DROP INDEX IF EXISTS reminders_due')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS reminders_guild_due ON reminders (guild, due)')
+
+    def add(self, reminders):
+        '''Insert (due, meta) reminders in a single transaction and return their ids'''
+        ids = []
+        with self.lock, self.conn:
+            for due, meta in reminders:
+                cursor = self.conn.execute('INSERT INTO reminders (due, meta, guild) VALUES (?, ?, ?)',
+                                           (due.isoformat(sep=' ', timespec='microseconds'),
+                                            json.dumps(meta, default=str), self.guild))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def complete(self, ids):
+        '''Delete the reminders that have been sent or skipped'''
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM reminders WHERE id = ?', [(i,) for i in ids])
+
+    def pending(self, until=None):
+        '''Returns the (id, due, meta) reminders ordered by due time, optionally only those due by `until`'''
+        query = 'SELECT id, due, meta FROM reminders WHERE guild IS ?'
+        params = (self.guild,)
+        if until is not None:
+            query += ' AND due <= ?'
+            params += (until.isoformat(sep=' ', timespec='microseconds'),)
+
+        with self.lock:
+            rows = self.conn.execute(query + ' ORDER BY due', params).fetchall()
+
+        return [(i, datetime.fromisoformat(due), json.loads(meta)) for i, due, meta in rows]
+
+    def claim(self):
+        '''Take over the reminders saved before they had a server'''
+        with self.lock, self.conn:
+            return self.conn.execute('UPDATE reminders SET guild = ? WHERE guild IS NULL', (self.guild,)).rowcount
+
+    def migrate(self, filename='reminders.pkl'):
+        '''One time import of the old (timestamps, map) pickle, which is renamed once imported'''
+        if not os.path.exists(filename):
+            return 0
+
+        try:
+            with open(filename, 'rb') as f:
+                reminders_ts, reminders_map = pickle.load(f)
+        except Exception as e:
+            print(f'[REMINDERS] Could not read {filename}, leaving it in place: {e}')
+            return 0
+
+        self.add([(ts, reminders_map[ts]) for ts in reminders_ts])
+        os.replace(filename, filename + '.migrated')
+        print(f'[REMINDERS] Migrated {len(reminders_ts)} reminders from {filename}')
+
+        return len(reminders_ts)
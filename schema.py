@@ -0,0 +1,138 @@
+'''Declarative command arguments: each command lists its typed fields once and gets a compiled parser
+
+    schema = Schema(Text('title', case=None), Choice('category', categories), required=['title'])
+    args = schema.parse('title=Black Holes, category=stem') # {'title': 'Black Holes', 'category': 'STEM Lab'}
+
+Messages are `col=val` pairs separated by commas, like the parse_args it replaced (kept in benchmark.py) read them.
+'''
+import re
+from datetime import datetime
+
+PAIR = re.compile(r'\s*([^=]+?)\s*=\s*(.*?)\s*', re.S)
+DATE = re.compile(r'(\d{1,2})-(\d{1,2})-(\d{4})') # dd-mm-yyyy
+DATETIME = re.compile(r'(\d{1,2})-(\d{1,2})-(\d{4})\s+(\d{1,2}):(\d{2})') # dd-mm-yyyy hh:mm
+
+
+class Aliases():
+    '''Normalization table of the shorthands and spellings of a set of values, eg: the categories'''
+
+    def __init__(self, shorthands):
+        self.shorthands = dict(shorthands) # shorthand -> canonical value
+        self.table = {} # any accepted spelling, lowercased -> canonical value
+
+        for short, canonical in self.shorthands.items():
+            self.table[short.lower()] = canonical
+            self.table[canonical.lower()] = canonical
+
+    def get(self, value):
+        '''Returns the canonical value, None if it isn't one'''
+        return self.table.get(value.strip().lower())
+
+    def values(self):
+        return list(self.shorthands.values())
+
+
+class ArgsError(ValueError):
+    '''The problems with the arguments of a command, as (field, problem) pairs'''
+
+    def __init__(self, errors, usage=''):
+        super().__init__(errors)
+        self.errors = errors
+        self.usage = usage
+
+    def __str__(self):
+        lines = [f'> {field}: {problem}' if field else f'> {problem}' for field, problem in self.errors]
+        usage = f'\nFormat: `{self.usage}`' if self.usage else ''
+        return "That command doesn't seem right?!\n```\n" + '\n'.join(lines) + '\n```' + usage
+
+
+# ===== Field Types =====
+# convert returns the typed value or raises ValueError with what is wrong with it
+
+class Text():
+
+    def __init__(self, name, case='title'):
+        self.name = name
+        self.case = case # 'title' to title case the value, None to keep it as typed
+
+    def convert(self, value):
+        if not value:
+            raise ValueError('is empty')
+        return value.title() if self.case == 'title' else value
+
+
+class Choice():
+
+    def __init__(self, name, aliases):
+        self.name = name
+        self.aliases = aliases
+
+    def convert(self, value):
+        canonical = self.aliases.get(value)
+        if canonical is None:
+            raise ValueError(f"unknown '{value}', use one of {', '.join(self.aliases.shorthands)}")
+        return canonical
+
+
+class Date():
+
+    def __init__(self, name, time=False):
+        self.name = name
+        self.time = time # dd-mm-yyyy hh:mm instead of dd-mm-yyyy
+        self.pattern = DATETIME if time else DATE
+
+    def convert(self, value):
+        match = self.pattern.fullmatch(value)
+        if match is None:
+            raise ValueError(f"'{value}' isn't {'dd-mm-yyyy hh:mm' if self.time else 'dd-mm-yyyy'}")
+
+        day, month, year, *clock = map(int, match.groups())
+        try:
+            return datetime(year, month, day, *clock)
+        except ValueError:
+            raise ValueError(f"'{value}' isn't a real date")
+
+
+class Schema():
+    '''Parser of the arguments of one command, built once from its fields'''
+
+    def __init__(self, *fields, required=(), at_least=0, unknown='ignore', usage=''):
+        self.fields = {field.name: field for field in fields}
+        self.required = list(required)
+        self.at_least = at_least # fields that must be given, when any of several will do
+        self.unknown = unknown # 'ignore' or 'error' for columns that aren't fields
+        self.usage = usage
+
+    def parse(self, msg):
+        '''Returns {field: typed value}, raising ArgsError with every problem found'''
+        args, errors = {}, []
+
+        for part in msg.split(','):
+            match = PAIR.fullmatch(part)
+            if match is None:
+                errors.append((None, f"'{part.strip()}' isn't col=val"))
+                continue
+
+            col, value = match[1].lower(), match[2]
+            field = self.fields.get(col)
+            if field is None:
+                if self.unknown == 'error':
+                    errors.append((col, f"isn't one of {', '.join(self.fields)}"))
+                continue
+
+            try:
+                args[col] = field.convert(value)
+            except ValueError as e:
+                errors.append((col, str(e)))
+
+        for name in self.required:
+            if name not in args and not any(col == name for col, _ in errors):
+                errors.append((name, 'is missing'))
+
+        if len(args) < self.at_least and not errors:
+            errors.append((None, f'give at least {self.at_least} of {", ".join(self.fields)}'))
+
+        if errors:
+            raise ArgsError(errors, self.usage)
+
+        return args
@@ -0,0 +1,129 @@
+import bisect
+import heapq
+import math
+import re
+from collections import Counter
+
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+class SearchIndex():
+    '''Inverted index over the name, title and category of the content rows, ranked with BM25'''
+
+    k1 = 1.5
+    b = 0.75
+    prefix_weight = 0.7 # a term that only matches as a prefix counts for less
+    max_expansions = 50 # vocabulary terms a prefix may expand to
+
+    def __init__(self, rows=()):
+        self.source = None # the snapshot the index was last synced with
+        self.clear()
+        self.extend(rows)
+
+    def clear(self):
+        self.docs = [] # (name, title, category) of each row
+        self.lengths = [] # terms per row
+        self.total = 0 # terms over all rows
+        self.postings = {} # term -> {row: term frequency}
+        self.vocab = [] # sorted terms, for prefix lookups
+
+    def __len__(self):
+        return len(self.docs)
+
+    @staticmethod
+    def fields(row):
+        values = (list(row) + [''] * 4)[:4]
+        return (values[0], values[1], values[3])
+
+    def _index(self, num, fields):
+        terms = Counter(tokenize(' '.join(fields)))
+        for term, tf in terms.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                bisect.insort(self.vocab, term)
+            self.postings[term][num] = tf
+
+        self.lengths[num] = sum(terms.values())
+        self.total += self.lengths[num]
+
+    def _unindex(self, num):
+        for term in set(tokenize(' '.join(self.docs[num]))):
+            posting = self.postings[term]
+            posting.pop(num, None)
+            if not posting:
+                del self.postings[term]
+                del self.vocab[bisect.bisect_left(self.vocab, term)]
+
+        self.total -= self.lengths[num]
+        self.lengths[num] = 0
+
+    def extend(self, rows):
+        '''Index new rows, appended after the existing ones'''
+        for row in rows:
+            fields = self.fields(row)
+            self.docs.append(fields)
+            self.lengths.append(0)
+            self._index(len(self.docs) - 1, fields)
+
+    def update(self, num, row):
+        '''Re-index a row whose values changed'''
+        self._unindex(num)
+        self.docs[num] = self.fields(row)
+        self._index(num, self.docs[num])
+
+    def sync(self, rows):
+        '''Bring the index up to date with a snapshot, only re-indexing the rows that changed or were added'''
+        if rows is self.source:
+            return
+
+        if len(rows) < len(self.docs):
+            self.clear()
+            self.extend(rows)
+        else:
+            for num, fields in enumerate(self.docs):
+                if self.fields(rows[num]) != fields:
+                    self.update(num, rows[num])
+            self.extend(rows[len(self.docs):])
+
+        self.source = rows
+
+    def expand(self, term):
+        '''Vocabulary terms starting with term, the exact term first'''
+        start = bisect.bisect_left(self.vocab, term)
+        matches = []
+        for t in self.vocab[start:start + self.max_expansions]:
+            if not t.startswith(term):
+                break
+            matches.append(t)
+        return matches
+
+    def search(self, query, k=10):
+        '''Returns the k best (row number, score) matches for the query'''
+        if not self.docs or self.total == 0:
+            return []
+
+        n = len(self.docs)
+        avgdl = self.total / n
+        scores = {}
+
+        for query_term in set(tokenize(query)):
+            best = {} # row -> best contribution of this query term
+            for term in self.expand(query_term):
+                posting = self.postings[term]
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                weight = 1 if term == query_term else self.prefix_weight
+
+                for num, tf in posting.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[num] / avgdl)
+                    score = weight * idf * tf * (self.k1 + 1) / norm
+                    if score > best.get(num, 0):
+                        best[num] = score
+
+            for num, score in best.items():
+                scores[num] = scores.get(num, 0) + score
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
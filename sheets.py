@@ -0,0 +1,437 @@
+import asyncio
+import functools
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from time import monotonic, perf_counter
+
+from metrics import metrics
+from supervisor import supervisor
+
+
+class TokenBucket():
+    '''Spaces out requests to stay within a rate limit, allowing short bursts'''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate # tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        '''Wait until a token is available and take it'''
+        async with self.lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def status_code(error):
+    '''HTTP status of a gspread APIError, None for other errors'''
+    return getattr(getattr(error, 'response', None), 'status_code', None)
+
+def unreachable(error):
+    '''Whether an error means Google Sheets is down or too slow, rather than the request being wrong'''
+    code = status_code(error)
+    return isinstance(error, (asyncio.TimeoutError, OSError)) or (code is not None and (code == 429 or code >= 500))
+
+def cell_updates(cells):
+    '''batch_update data for (row, col, value) cell updates'''
+    from gspread.utils import rowcol_to_a1
+    return [{'range': rowcol_to_a1(row, col), 'values': [[value]]} for row, col, value in cells]
+
+
+class AsyncSheets():
+    '''Runs blocking gspread calls on a bounded thread pool, off the event loop'''
+
+    def __init__(self, workers=4, timeout=30, quota=60, retries=5):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sheets')
+        self.timeout = timeout # default seconds before a call is abandoned
+
+        # A burst plus the refill over a minute stays within the per minute Sheets quota
+        burst = max(1, quota // 10)
+        self.bucket = TokenBucket(rate=(quota - burst) / 60, capacity=burst)
+        self.retries = retries
+
+        self.inflight = {} # key -> task of the identical read already in progress
+
+        self.down = False # whether the latest call found Sheets unreachable
+        self.recovered = asyncio.Event() # set when a call goes through again after that
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        '''Await a blocking call, raising asyncio.TimeoutError if it takes too long'''
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.pool, functools.partial(fn, *args, **kwargs))
+
+        # On timeout the await is abandoned: a call still queued is dropped, but one already running keeps
+        # its thread until the HTTP timeout set in connect() ends it
+        return await asyncio.wait_for(future, timeout or self.timeout)
+
+    async def request(self, fn, *args, key=None, write=False, **kwargs):
+        '''Make a Google Sheets API call within the quota, retrying rate limit and server errors
+
+        Concurrent reads with the same key share a single request.
+        '''
+        if key is None:
+            return await self._request(fn, args, kwargs, write)
+
+        if key not in self.inflight:
+            task = asyncio.ensure_future(self._request(fn, args, kwargs, write))
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self.forget(key, done))
+        else:
+            metrics.inc('sheets_coalesced_total', call=fn.__name__)
+
+        # One waiter giving up doesn't cancel the request for the others
+        return await asyncio.shield(self.inflight[key])
+
+    def forget(self, key, task=None):
+        '''Stop sharing the in-flight read for key (only if it is still `task`), later reads start a new request'''
+        if task is None or self.inflight.get(key) is task:
+            self.inflight.pop(key, None)
+
+    async def _request(self, fn, args, kwargs, write):
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            try:
+                return await self._attempt(fn, args, kwargs)
+            except Exception as e:
+                code = status_code(e)
+
+                # A write that failed with a server error may have been applied, so only 429s are retried
+                retryable = code == 429 or (not write and code is not None and code >= 500)
+                if not retryable or attempt == self.retries:
+                    raise
+
+                delay = random.uniform(0, min(32, 2 ** attempt)) # full jitter backoff
+                metrics.inc('sheets_retries_total', call=fn.__name__, status=code)
+                print(f'[SHEETS] {fn.__name__} failed with {code}, retrying in {delay:.1f}s')
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, fn, args, kwargs):
+        '''One try of an API call, the only place the Sheets metrics are recorded'''
+        t = perf_counter()
+        try:
+            result = await self.run(fn, *args, **kwargs)
+        except Exception as e:
+            metrics.inc('sheets_errors_total', call=fn.__name__, error=type(e).__name__)
+            self.down = self.down or unreachable(e)
+            raise
+        finally:
+            metrics.observe('sheets_call_seconds', perf_counter() - t, call=fn.__name__)
+
+        if self.down:
+            self.down = False
+            self.recovered.set()
+        return result
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def connect(keyfile='creds.json', name='Content-DB', timeout=None):
+    '''Authorize once and return the spreadsheet handle shared by all the mods'''
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    scope = ["https://spreadsheets.google.com/feeds",
+             "https://www.googleapis.com/auth/spreadsheets",
+             "https://www.googleapis.com/auth/drive.file",
+             "https://www.googleapis.com/auth/drive"]
+    creds = ServiceAccountCredentials.from_json_keyfile_name(keyfile, scope)
+    gclient = gspread.authorize(creds)
+
+    # Without an HTTP timeout a hung request holds its pool thread forever, after run() has given up on it
+    gclient.set_timeout(timeout or blocking.timeout)
+
+    return gclient.open(name)
+
+
+# Shared by all the mods so the number of concurrent Sheets calls stays bounded
+blocking = AsyncSheets(workers=int(os.environ.get('SHEETS_WORKERS', 4)),
+                       timeout=float(os.environ.get('SHEETS_TIMEOUT', 30)),
+                       quota=int(os.environ.get('SHEETS_QUOTA', 60)))
+
+# The local SQLite files get their own thread, so the mirror still answers while hung Sheets calls hold the pool
+local = ThreadPoolExecutor(max_workers=1, thread_name_prefix='local')
+
+async def run_local(fn, *args, **kwargs):
+    '''Await a blocking call on a local file, off the event loop and the Sheets pool'''
+    t = perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(local, functools.partial(fn, *args, **kwargs))
+    finally:
+        metrics.observe('local_io_seconds', perf_counter() - t, call=fn.__name__)
+
+
+class WriteQueue():
+    '''Write-behind queue that coalesces the writes to each worksheet into batched calls'''
+
+    def __init__(self, window=0.5, runner=blocking, mirror=None):
+        self.window = window # seconds to wait for more writes before committing
+        self.runner = runner
+        self.mirror = mirror # holds the writes while Sheets is unreachable
+
+        self.pending = {} # worksheet id -> batch of writes not yet committed
+        self.flushers = {} # worksheet id -> task that will commit its batch
+        self.tasks = set() # all flusher tasks, including the ones committing right now
+        self.hurry = asyncio.Event() # set by flush() to skip the window
+
+        self.backlog = None # worksheet indices with writes waiting in the mirror, read from it on first use
+        self.locks = {} # worksheet index -> lock, so its writes and replays go out one at a time, in order
+
+    def append_row(self, sheet, row):
+        '''Queue a row to be appended, returns a future that resolves once it is written'''
+        return self._enqueue(sheet, 'append', list(row))
+
+    def update_cell(self, sheet, row, col, value):
+        '''Queue a cell update, returns a future that resolves once it is written'''
+        return self._enqueue(sheet, 'cells', (row, col, value))
+
+    def _enqueue(self, sheet, kind, op):
+        future = asyncio.get_running_loop().create_future()
+
+        batch = self.pending.setdefault(sheet.id, {'sheet': sheet, 'append': [], 'cells': []})
+        batch[kind].append((op, future))
+
+        if sheet.id not in self.flushers:
+            task = asyncio.create_task(self._flush_later(sheet.id))
+            self.flushers[sheet.id] = task
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        return future
+
+    async def _flush_later(self, key):
+        try:
+            await asyncio.wait_for(self.hurry.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+
+        # Writes queued from here on go into a new batch
+        del self.flushers[key]
+        batch = self.pending.pop(key)
+        sheet = batch['sheet']
+
+        try:
+            if batch['cells']:
+                data = cell_updates(op for op, _ in batch['cells'])
+                await self._commit(sheet, 'cells', batch['cells'], sheet.batch_update, data, value_input_option='USER_ENTERED')
+
+            if batch['append']:
+                rows = [row for row, _ in batch['append']]
+                await self._commit(sheet, 'append', batch['append'], sheet.append_rows, rows)
+        finally:
+            # Even if committing was cancelled or broke, nobody is left waiting on a write forever
+            for _, future in batch['cells'] + batch['append']:
+                if not future.done():
+                    future.set_exception(RuntimeError(f'Write to worksheet {sheet.index} was not committed'))
+
+    async def _commit(self, sheet, kind, ops, fn, *args, **kwargs):
+        '''Make the batched call and resolve the futures of its writes with None, or "queued" if saved for later'''
+        async with self._lock(sheet.index):
+            try:
+                # Writes still waiting in the mirror go first, or they would overwrite this one when replayed later
+                await self._drain(sheet)
+                await self.runner.request(fn, *args, write=True, **kwargs)
+                print(f'[WRITES] Committed {len(ops)} writes with {fn.__name__}')
+                result = None
+            except Exception as e:
+                result = e
+                if self.mirror is not None and unreachable(e):
+                    # Replayed once Sheets is back, at least once, since a timed out call may have gone through
+                    try:
+                        await run_local(self.mirror.queue, sheet.index, kind, [op for op, _ in ops])
+                        if self.backlog is not None:
+                            self.backlog.add(sheet.index)
+                        print(f'[WRITES] Sheets unreachable, queued {len(ops)} writes ({e!r})')
+                        result = 'queued'
+                    except Exception as queue_error:
+                        print(f'[WRITES] Sheets unreachable ({e!r}) and queueing {len(ops)} writes failed ({queue_error!r})')
+                        result = queue_error
+
+        for _, future in ops:
+            if not future.done():
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _lock(self, idx):
+        return self.locks.setdefault(idx, asyncio.Lock())
+
+    async def _drain(self, sheet):
+        '''Send the writes to a worksheet waiting in the mirror, in the order they were made. Returns how many'''
+        if self.mirror is None:
+            return 0
+
+        if self.backlog is None:
+            self.backlog = {idx for _, idx, _, _ in await run_local(self.mirror.outbox)}
+        if sheet.index not in self.backlog:
+            return 0
+
+        entries = [entry for entry in await run_local(self.mirror.outbox) if entry[1] == sheet.index]
+
+        # Only consecutive writes of the same kind are batched, eg: an update of a row appended offline has to
+        # wait for the append
+        for kind, run in groupby(entries, key=lambda entry: entry[2]):
+            run = [(i, op) for i, _, _, op in run]
+
+            if kind == 'cells':
+                await self.runner.request(sheet.batch_update, cell_updates(op for _, op in run),
+                                          write=True, value_input_option='USER_ENTERED')
+            else:
+                await self.runner.request(sheet.append_rows, [op for _, op in run], write=True)
+
+            await run_local(self.mirror.sent, [i for i, _ in run])
+            print(f'[WRITES] Replayed {len(run)} queued writes to worksheet {sheet.index}')
+
+        self.backlog.discard(sheet.index)
+        return len(entries)
+
+    async def replay(self, cache):
+        '''Send the writes queued in the mirror while Sheets was unreachable'''
+        if self.backlog is None:
+            self.backlog = {idx for _, idx, _, _ in await run_local(self.mirror.outbox)}
+
+        for idx in sorted(self.backlog):
+            sheet = await cache.worksheet(idx)
+            async with self._lock(idx):
+                replayed = await self._drain(sheet)
+            if replayed:
+                cache.invalidate(idx)
+
+    async def flush(self):
+        '''Commit all the pending writes right away, eg: on shutdown'''
+        self.hurry.set()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.hurry.clear()
+
+
+# Shared so writes from every mod to the same worksheet are batched together
+writes = WriteQueue(window=float(os.environ.get('SHEETS_WRITE_WINDOW', 0.5)))
+
+
+class SheetCache():
+    '''In-process read-through cache of the Content-DB worksheets'''
+
+    def __init__(self, db, ttl=300, runner=blocking, mirror=None):
+        self.db = db
+        self.ttl = ttl # seconds a snapshot stays fresh
+        self.runner = runner
+        self.mirror = mirror # local copy to serve from when Sheets is unreachable
+
+        self.worksheets = {} # worksheet index -> gspread worksheet
+        self.snapshots = {} # worksheet index -> (fetched at, rows)
+        self.generations = {} # worksheet index -> times it was invalidated
+        self.downloads = {} # worksheet index -> task of the download in progress
+        self.modified = {} # worksheet index -> last update time of the spreadsheet before run_mirror downloaded it
+
+    async def worksheet(self, idx):
+        '''Returns the worksheet handle, fetching its metadata only once'''
+        if idx not in self.worksheets:
+            self.worksheets[idx] = await self.runner.request(self.db.get_worksheet, idx, key=('worksheet', self.db.id, idx))
+        return self.worksheets[idx]
+
+    async def get(self, idx):
+        '''Returns the rows (without the header) of a worksheet from the snapshot cache'''
+        entry = self.snapshots.get(idx)
+
+        if entry is None or monotonic() - entry[0] > self.ttl:
+            # Concurrent misses share one download, and so the same rows, so what is derived from them is built once
+            if idx not in self.downloads:
+                task = asyncio.ensure_future(self._download(idx))
+                self.downloads[idx] = task
+                task.add_done_callback(lambda done: self._forget(idx, done))
+
+            entry = await asyncio.shield(self.downloads[idx])
+
+        return entry[1]
+
+    async def _download(self, idx):
+        generation = self.generations.get(idx, 0)
+        try:
+            sheet = await self.worksheet(idx)
+            rows = (await self.runner.request(sheet.get_all_values, key=('values', self.db.id, sheet.id)))[1:]
+            entry = (monotonic(), rows)
+            print(f'[CACHE] Downloaded worksheet {idx} ({len(rows)} rows)')
+
+            if self.mirror is not None:
+                await run_local(self.mirror.sync, idx, rows)
+
+        except Exception as e:
+            if self.mirror is None or not unreachable(e) or not await run_local(self.mirror.has, idx):
+                raise
+
+            # Serve the mirror, and try Sheets again in a minute
+            print(f'[CACHE] Sheets unreachable ({e!r}), serving worksheet {idx} from the mirror')
+            rows = await run_local(self.mirror.rows, idx)
+            entry = (monotonic() - self.ttl + 60, rows)
+
+        # Don't keep a snapshot that was invalidated while it was downloading
+        if self.generations.get(idx, 0) == generation:
+            self.snapshots[idx] = entry
+
+        return entry
+
+    def _forget(self, idx, task):
+        if self.downloads.get(idx) is task:
+            del self.downloads[idx]
+
+    def invalidate(self, idx=None):
+        '''Drops the snapshot of a worksheet, or of all worksheets if no index is given'''
+        for i in (self.worksheets if idx is None else [idx]):
+            self.snapshots.pop(i, None)
+            self.generations[i] = self.generations.get(i, 0) + 1
+
+            # A read that started before the write that caused this may be stale
+            self.downloads.pop(i, None)
+            if i in self.worksheets:
+                self.runner.forget(('values', self.db.id, self.worksheets[i].id))
+
+    def last_update(self):
+        '''Last modification time of the spreadsheet, None if gspread can't tell'''
+        getter = getattr(self.db, 'get_lastUpdateTime', None)
+        return getter() if getter is not None else None
+
+    async def run_mirror(self, writes, interval=600, job='mirror'):
+        '''Periodically replay the queued writes and re-sync the mirror of the worksheets that were read'''
+        print('Running Mirror Sync...')
+
+        while(1):
+            # Woken early when Sheets answers again after an outage, so the queued writes go out right away
+            try:
+                await asyncio.wait_for(self.runner.recovered.wait(), interval)
+                self.runner.recovered.clear()
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                with supervisor.timed(job):
+                    await writes.replay(self)
+
+                    # Only the worksheets served from here whose snapshot expired, the links are mirrored by the
+                    # newsbot and the leavers as they are appended
+                    expired = [idx for idx, (fetched, _) in self.snapshots.items() if monotonic() - fetched > self.ttl]
+                    if not expired:
+                        continue
+
+                    modified = await self.runner.request(self.last_update, key=('last_update', self.db.id))
+                    for idx in expired:
+                        if modified is not None and modified == self.modified.get(idx) and idx in self.snapshots:
+                            # Unchanged since it was downloaded, so keep the snapshot and what was built from it
+                            self.snapshots[idx] = (monotonic(), self.snapshots[idx][1])
+                        else:
+                            await self.get(idx)
+                            self.modified[idx] = modified
+            except Exception as e:
+                print(f'[MIRROR] Sync failed: {e!r}')
@@ -0,0 +1,115 @@
+import asyncio
+import random
+from contextlib import contextmanager
+from datetime import datetime
+from time import monotonic
+
+from prettytable import PrettyTable
+
+from metrics import metrics
+
+
+class Job():
+    '''A supervised background job and what is known about its health'''
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory # coroutine function, called again on every restart
+        self.task = None # the supervising task
+        self.state = 'starting'
+        self.started = None # monotonic time the current attempt started
+        self.restarts = 0
+        self.failures = 0 # crashes in a row, for the backoff
+        self.error = None # last crash
+
+        # Set by the job itself through Supervisor.ran
+        self.last_run = None # datetime the last unit of work finished
+        self.last_duration = None # seconds it took
+
+
+class Supervisor():
+    '''Runs each background job exactly once, restarting it with backoff if it crashes'''
+
+    def __init__(self, base_delay=1, max_delay=300, reset_after=600):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.reset_after = reset_after # seconds a job has to run to clear its crash count
+        self.jobs = {} # name -> Job
+
+    def start(self, name, factory):
+        '''Start a job unless it is already running, eg: when on_ready fires again after a reconnect'''
+        job = self.jobs.get(name)
+        if job is not None and job.task is not None and not job.task.done():
+            return job
+
+        job = Job(name, factory)
+        job.task = asyncio.create_task(self._supervise(job))
+        self.jobs[name] = job
+        return job
+
+    async def _supervise(self, job):
+        while True:
+            job.state = 'running'
+            job.started = monotonic()
+            try:
+                await job.factory()
+                job.state = 'finished'
+                return
+            except Exception as e:
+                job.error = f'{datetime.now():%d-%m %H:%M} {e!r}'
+                if monotonic() - job.started > self.reset_after:
+                    job.failures = 0
+                job.failures += 1
+
+            # Full jitter, so jobs that failed on the same outage don't retry in lockstep
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** job.failures))
+            print(f'[SUPERVISOR] {job.name} crashed with {job.error}, restarting in {delay:.0f}s')
+            metrics.inc('task_restarts_total', job=job.name)
+
+            job.state = 'restarting'
+            await asyncio.sleep(delay)
+            job.restarts += 1
+
+    def ran(self, name, seconds):
+        '''Record that a job finished a unit of work, for the health report'''
+        job = self.jobs.get(name)
+        if job is not None:
+            job.last_run = datetime.now()
+            job.last_duration = seconds
+
+    @contextmanager
+    def timed(self, name):
+        '''Time a unit of work of a job'''
+        t = monotonic()
+        try:
+            yield
+        finally:
+            self.ran(name, monotonic() - t)
+
+    async def stop(self):
+        '''Cancel all the jobs and wait for them to finish'''
+        tasks = [job.task for job in self.jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for job in self.jobs.values():
+            if job.state != 'finished':
+                job.state = 'stopped'
+
+    def health(self):
+        '''Returns a table of the state of every job, for the --health command'''
+        table = PrettyTable(['Job', 'State', 'Up (s)', 'Restarts', 'Last Run', 'Took (ms)', 'Last Error'])
+        table.align['Last Error'] = 'l'
+
+        for job in self.jobs.values():
+            up = f'{monotonic() - job.started:.0f}' if job.state == 'running' else ''
+            last_run = f'{job.last_run:%d-%m %H:%M:%S}' if job.last_run else ''
+            took = f'{job.last_duration * 1000:.1f}' if job.last_duration is not None else ''
+            table.add_row([job.name, job.state, up, job.restarts, last_run, took, (job.error or '')[:60]])
+
+        return str(table)
+
+
+# Shared by the bot and the mods
+supervisor = Supervisor()
@@ -0,0 +1,115 @@
+class Row():
+    '''A row of the content sheet'''
+    __slots__ = ('name', 'title', 'status', 'category')
+
+    def __init__(self, name='', title='', status='', category=''):
+        self.name = name
+        self.title = title
+        self.status = status
+        self.category = category
+
+    def values(self):
+        return [self.name, self.title, self.status, self.category]
+
+
+class ContentTable():
+    '''Compact in-memory store of the content sheet with value indexes on the filterable columns'''
+
+    columns = ('name', 'title', 'status', 'category')
+    indexed = ('name', 'status', 'category')
+
+    def __init__(self, rows=()):
+        self.source = rows # the snapshot the table was built from
+        self.rows = []
+        self.index = {col: {} for col in self.indexed} # column -> value -> row numbers
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def extend(self, rows):
+        '''Append rows (lists of cell values) and index them'''
+        for values in rows:
+            row = Row(*values[:len(self.columns)])
+            num = len(self.rows)
+            self.rows.append(row)
+
+            for col in self.indexed:
+                self.index[col].setdefault(getattr(row, col), []).append(num)
+
+    def select(self, filters):
+        '''Returns the rows, in sheet order, matching all the (column, value) filters'''
+        for col, _ in filters:
+            if col not in self.columns:
+                raise KeyError(col)
+
+        # Intersect the posting lists of the indexed filters, smallest first
+        postings = sorted((self.index[col].get(val, []) for col, val in filters if col in self.index), key=len)
+
+        if postings:
+            nums = set(postings[0])
+            for posting in postings[1:]:
+                nums.intersection_update(posting)
+            candidates = [self.rows[num] for num in sorted(nums)]
+        else:
+            candidates = self.rows
+
+        # Scan what's left for the unindexed filters
+        scans = [(col, val) for col, val in filters if col not in self.index]
+        return [row for row in candidates if all(getattr(row, col) == val for col, val in scans)]
+
+
+class TableFormatter():
+    '''PrettyTable style text table with the column widths computed once, so any slice of rows renders alike'''
+
+    def __init__(self, columns, rows, max_width=40):
+        self.columns = columns
+        self.rows = rows
+
+        self.widths = [len(col) for col in columns]
+        for row in rows:
+            for i, cell in enumerate(row):
+                self.widths[i] = max(self.widths[i], len(str(cell)))
+        self.widths = [min(w, max_width) for w in self.widths]
+
+        self.border = '+' + '+'.join('-' * (w + 2) for w in self.widths) + '+'
+        self.header = '\n'.join([self.border, self.line(columns), self.border])
+
+    def line(self, values):
+        cells = []
+        for value, width in zip(values, self.widths):
+            value = str(value)
+            if len(value) > width:
+                value = value[:width - 1] + '…'
+            cells.append(value.center(width))
+        return '| ' + ' | '.join(cells) + ' |'
+
+    def render(self, start, stop):
+        '''Returns the table of rows[start:stop]'''
+        lines = [self.line(row) for row in self.rows[start:stop]]
+        return '\n'.join([self.header] + lines + [self.border])
+
+
+class Paginator():
+    '''Splits a table into pages that fit in a Discord message, rendering each page only when it is asked for'''
+
+    def __init__(self, title, formatter, limit=2000):
+        self.title = title
+        self.formatter = formatter
+
+        # Every row renders to the same width, so the rows per page are known up front
+        footer = len('\nPage 9999/9999')
+        budget = limit - len(title) - len('\n```\n') - len(formatter.header) - len('\n') - len(formatter.border) - len('\n```') - footer
+        self.per_page = max(1, budget // (len('\n') + len(formatter.border)))
+        self.count = max(1, -(-len(formatter.rows) // self.per_page))
+
+        self.cache = {} # page number -> rendered page
+
+    def page(self, num):
+        '''Returns page num (0 based) as a message'''
+        if num not in self.cache:
+            start = num * self.per_page
+            table = self.formatter.render(start, start + self.per_page)
+            footer = f'\nPage {num + 1}/{self.count}' if self.count > 1 else ''
+            self.cache[num] = f'{self.title}\n```\n{table}\n```{footer}'
+        return self.cache[num]
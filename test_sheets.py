@@ -0,0 +1,155 @@
+'''Tests of the write-behind queue falling back to the mirror, run with: python -m pytest test_sheets.py'''
+import asyncio
+import os
+import tempfile
+import unittest
+
+import fakes
+from mirror import Mirror
+from sheets import AsyncSheets, SheetCache, WriteQueue
+
+
+def offline(sheet, *names):
+    '''Make the write calls of a fake worksheet fail like Sheets being down'''
+    def down(*args, **kwargs):
+        raise ConnectionError('Sheets is down')
+
+    for name in names:
+        setattr(sheet, name, down)
+
+
+class WriteQueueMirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = fakes.content_db(3, links=0)
+        self.sheet = self.db.get_worksheet(0)
+        self.mirror = Mirror(os.path.join(self.tmp.name, 'content.db'))
+
+    def tearDown(self):
+        self.mirror.conn.close()
+        self.tmp.cleanup()
+
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 10))
+
+    def test_replay_keeps_the_order_of_the_writes(self):
+        async def scenario():
+            runner = AsyncSheets(workers=1, timeout=5, quota=100000)
+            cache = SheetCache(self.db, runner=runner, mirror=self.mirror)
+            writes = WriteQueue(window=0, runner=runner, mirror=self.mirror)
+            await cache.get(0)
+
+            # A row added while Sheets is down, then updated before it is back
+            offline(self.sheet, 'append_rows', 'batch_update')
+            added = writes.append_row(self.sheet, ['ishaan', 'Offline Title', 'WIP', 'STEM Lab'])
+            self.assertEqual(await added, 'queued')
+            updated = writes.update_cell(self.sheet, 5, 3, 'Review')
+            self.assertEqual(await updated, 'queued')
+
+            del self.sheet.append_rows, self.sheet.batch_update
+            await writes.replay(cache)
+            runner.shutdown()
+
+        self.run_async(scenario())
+
+        self.assertEqual(len(self.sheet.rows), 5)
+        self.assertEqual(self.sheet.rows[4], ['ishaan', 'Offline Title', 'Review', 'STEM Lab'])
+        self.assertEqual(self.mirror.outbox(), [])
+
+    def test_writes_after_an_outage_wait_for_the_queued_ones(self):
+        async def scenario():
+            runner = AsyncSheets(workers=1, timeout=5, quota=100000)
+            writes = WriteQueue(window=0, runner=runner, mirror=self.mirror)
+
+            offline(self.sheet, 'append_rows', 'batch_update')
+            self.assertEqual(await writes.update_cell(self.sheet, 2, 3, 'Writing'), 'queued')
+            self.assertEqual(await writes.append_row(self.sheet, ['ishaan', 'Offline Title', 'WIP', 'STEM Lab']), 'queued')
+            self.assertEqual(await writes.update_cell(self.sheet, 5, 3, 'Review'), 'queued')
+
+            # Back before the replay, the newer writes go out after the queued ones
+            del self.sheet.append_rows, self.sheet.batch_update
+            self.assertIsNone(await writes.update_cell(self.sheet, 2, 3, 'Published'))
+            self.assertIsNone(await writes.append_row(self.sheet, ['anushk', 'Online Title', 'WIP', 'Psyche']))
+            runner.shutdown()
+
+        self.run_async(scenario())
+
+        self.assertEqual(self.sheet.rows[1][2], 'Published')
+        self.assertEqual(self.sheet.rows[4], ['ishaan', 'Offline Title', 'Review', 'STEM Lab'])
+        self.assertEqual(self.sheet.rows[5], ['anushk', 'Online Title', 'WIP', 'Psyche'])
+        self.assertEqual(self.mirror.outbox(), [])
+
+    def test_replay_starts_once_sheets_answers_again(self):
+        async def scenario():
+            runner = AsyncSheets(workers=1, timeout=5, quota=100000)
+            cache = SheetCache(self.db, runner=runner, mirror=self.mirror)
+            writes = WriteQueue(window=0, runner=runner, mirror=self.mirror)
+            await cache.get(0)
+            mirror = asyncio.create_task(cache.run_mirror(writes, interval=600))
+
+            offline(self.sheet, 'batch_update')
+            self.assertEqual(await writes.update_cell(self.sheet, 2, 3, 'Writing'), 'queued')
+
+            # Any call going through again, here a read, wakes the replay
+            del self.sheet.batch_update
+            cache.invalidate(0)
+            await cache.get(0)
+            for _ in range(100):
+                if not self.mirror.outbox():
+                    break
+                await asyncio.sleep(0.01)
+
+            mirror.cancel()
+            runner.shutdown()
+
+        self.run_async(scenario())
+
+        self.assertEqual(self.sheet.rows[1][2], 'Writing')
+        self.assertEqual(self.mirror.outbox(), [])
+
+    def test_mirror_sync_downloads_only_changed_sheets_it_serves(self):
+        async def scenario():
+            runner = AsyncSheets(workers=1, timeout=5, quota=100000)
+            cache = SheetCache(self.db, ttl=0.05, runner=runner, mirror=self.mirror)
+            writes = WriteQueue(window=0, runner=runner, mirror=self.mirror)
+            await cache.get(0)
+            mirror = asyncio.create_task(cache.run_mirror(writes, interval=0.1))
+
+            await asyncio.sleep(0.5)
+            unchanged = self.sheet.calls
+            await writes.update_cell(self.sheet, 2, 3, 'Review')
+            await asyncio.sleep(0.5)
+
+            mirror.cancel()
+            runner.shutdown()
+            return unchanged
+
+        unchanged = self.run_async(scenario())
+
+        # One download, then one more for the first sync and one after the write
+        self.assertEqual(unchanged, 2)
+        self.assertEqual(self.sheet.calls, 4)
+        self.assertEqual(self.db.get_worksheet(1).calls, 0)
+        self.assertEqual(self.mirror.rows(0)[0][2], 'Review')
+
+    def test_futures_resolve_when_queueing_fails(self):
+        def broken(*args, **kwargs):
+            raise OSError('disk full')
+        self.mirror.queue = broken
+
+        async def scenario():
+            runner = AsyncSheets(workers=1, timeout=5, quota=100000)
+            writes = WriteQueue(window=0, runner=runner, mirror=self.mirror)
+
+            offline(self.sheet, 'append_rows')
+            added = writes.append_row(self.sheet, ['ishaan', 'Lost Title', 'WIP', 'STEM Lab'])
+            with self.assertRaises(OSError):
+                await added
+            runner.shutdown()
+
+        self.run_async(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,48 +1,123 @@
-import parse
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-import pickle
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
 
-def parse_args(msg):
-    # Get the argument pairs in a list
-    args = list(map(lambda x: x.strip(), msg.split(',')))
-    # Parse the arguments into a list of dicts
-    args = list(map(lambda x: parse.parse('{col}={val}', x), args))
+# numpy, scipy and scikit-learn are imported on first use, they take seconds to load on the Pi
+_numeric = None # future of importing them off the event loop
 
-    return args
+def split_entries(text):
+    '''Split a message with many commands, one per line or separated by ;'''
+    return [entry.strip() for line in text.splitlines() for entry in line.split(';') if entry.strip()]
+
+async def sleep_until(when):
+    '''Sleep until the given datetime, returns right away if it has passed'''
+    await asyncio.sleep(max(0, (when - datetime.now()).total_seconds()))
 
 def check_similar(s1, s2):
     '''Returns the cosine similarity of two strings'''
+    from sklearn.metrics.pairwise import cosine_similarity
+    from sklearn.feature_extraction.text import CountVectorizer
+
     vectors = CountVectorizer().fit_transform([s1, s2]).toarray()
     similarity = cosine_similarity(vectors)[0, 1]
 
     return similarity
 
-def save_reminders(obj, filename='reminders.pkl'):
-    with open(filename, 'wb') as f:
-        pickle.dump(obj, f)
-         
-def load_reminders(filename='reminders.pkl'):
-    with open(filename, 'rb') as f:
-        obj = pickle.load(f)
-    return obj
-
-def update_reminders(obj, filename='reminders.pkl'):
-    # Load the reminders object
-    try:
-        reminders = load_reminders()
-        # Update/Append the reminders
-        reminders[0].extend(obj[0])
-        reminders[1].update(obj[1])
-    except:
-        reminders = obj
-    
-    # Save the reminders
-    save_reminders(reminders)
-    
-def remove_save(reminders_ts, reminders_map):
-    '''Remove the first element with the corresponding key-value pair and save it'''
-    reminders_ts.remove(reminders_ts[0])
-#     reminders_map.pop(reminders_ts[0])
-    save_reminders((reminders_ts, reminders_map))
\ No newline at end of file
+def _import_numeric():
+    import numpy
+    import scipy.sparse
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+def load_numeric():
+    '''Import the libraries TitleIndex uses in a thread, once. Await the returned future before using a
+    TitleIndex on the event loop, so their import doesn't block it'''
+    global _numeric
+    if _numeric is None:
+        _numeric = asyncio.get_running_loop().run_in_executor(None, _import_numeric)
+    return _numeric
+
+class TitleIndex():
+    '''Sparse bag-of-words index of titles for cosine similarity lookups'''
+
+    def __init__(self, titles=()):
+        self.vectorizer = None # created on first use
+        self.titles = []
+        self.matrix = None
+        self.add(titles)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def vectorize(self, titles):
+        if self.vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            # l2 normalized counts, so a dot product is the same cosine similarity as check_similar
+            self.vectorizer = HashingVectorizer(alternate_sign=False, norm='l2')
+        return self.vectorizer.transform(titles)
+
+    def add(self, titles):
+        '''Vectorize and append new titles to the index'''
+        titles = list(titles)
+        if len(titles) == 0:
+            return
+
+        import scipy.sparse as sp
+
+        vectors = self.vectorize(titles)
+        self.matrix = vectors if self.matrix is None else sp.vstack([self.matrix, vectors], format='csr')
+        self.titles.extend(titles)
+
+    def sync(self, titles):
+        '''Bring the index up to date, only vectorizing the new titles if the old ones are unchanged'''
+        n = len(self.titles)
+        if titles[:n] == self.titles:
+            self.add(titles[n:])
+        else:
+            self.titles, self.matrix = [], None
+            self.add(titles)
+
+    def top(self, query, k=5):
+        '''Returns the k most similar titles as (row index, score) pairs, best first'''
+        import numpy as np
+
+        if len(self.titles) == 0:
+            return []
+
+        scores = (self.matrix @ self.vectorize([query]).T).toarray().ravel()
+
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.lexsort((best, -scores[best]))] # ties go to the earlier row
+
+        return [(int(i), float(scores[i])) for i in best]
+
+class PhaseTimer():
+    '''Records how long each phase of the startup takes'''
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.last = self.started # end of the latest phase
+        self.phases = [] # (name, seconds)
+        self.done = False
+
+    @contextmanager
+    def phase(self, name):
+        t = perf_counter()
+        try:
+            yield
+        finally:
+            self.last = perf_counter()
+            self.phases.append((name, self.last - t))
+
+    def lap(self, name):
+        '''Record a phase that ran from the end of the previous one until now'''
+        now = perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        '''Returns the per phase timings as a printable string'''
+        lines = [f'  {name:<20} {seconds:7.2f}s' for name, seconds in self.phases]
+        lines.append(f"  {'total':<20} {perf_counter() - self.started:7.2f}s")
+        return 'Startup Times\n' + '\n'.join(lines)